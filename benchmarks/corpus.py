@@ -0,0 +1,101 @@
+"""Synthetic documents in the shapes that stress different parts of kbinxml.
+
+Every generator is deterministic for a given seed and returns annotated XML
+text (as bytes), ready for `KBinXML`.
+"""
+
+import random
+
+from lxml import etree
+
+# common-ish cp932 text, so string nodes hit the multibyte codec
+_KANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+_KANJI = "日本語文字列試験曲名譜面難易度得点記録"
+
+
+def _text(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(_KANA + _KANJI) for _ in range(length))
+
+
+def _to_bytes(root) -> bytes:
+    return etree.tostring(root, encoding="UTF-8", xml_declaration=True)
+
+
+def deep(depth=200, seed=0) -> bytes:
+    """A single chain of nested nodes, each with a small value"""
+    rng = random.Random(seed)
+    root = etree.Element("root")
+    node = root
+    for i in range(depth):
+        node = etree.SubElement(node, f"level{i % 10}")
+        value = etree.SubElement(node, "v", __type="s32")
+        value.text = str(rng.randint(-(2**31), 2**31 - 1))
+    return _to_bytes(root)
+
+
+def wide(siblings=5000, seed=0) -> bytes:
+    """Many siblings with mixed small types, like a long list of records"""
+    rng = random.Random(seed)
+    root = etree.Element("root")
+    types = [("u8", 255), ("s16", 32767), ("u32", 2**32 - 1), ("s64", 2**63 - 1)]
+    for i in range(siblings):
+        name, limit = types[i % len(types)]
+        node = etree.SubElement(root, "item", __type=name)
+        node.text = str(rng.randint(0, limit))
+    return _to_bytes(root)
+
+
+def arrays(count=20000, nodes=4, seed=0) -> bytes:
+    """A few large `__count` arrays of ints and floats"""
+    rng = random.Random(seed)
+    root = etree.Element("root")
+    for i in range(nodes):
+        if i % 2:
+            node = etree.SubElement(root, "scores", __type="s32", __count=str(count))
+            node.text = " ".join(
+                str(rng.randint(-1000000, 1000000)) for _ in range(count)
+            )
+        else:
+            node = etree.SubElement(root, "rates", __type="float", __count=str(count))
+            node.text = " ".join(f"{rng.uniform(-100, 100):.6f}" for _ in range(count))
+    return _to_bytes(root)
+
+
+def strings(count=3000, length=24, seed=0) -> bytes:
+    """Many cp932-encodable strings"""
+    rng = random.Random(seed)
+    root = etree.Element("root")
+    for _ in range(count):
+        node = etree.SubElement(root, "name", __type="str")
+        node.text = _text(rng, rng.randint(1, length))
+    return _to_bytes(root)
+
+
+def blobs(count=8, size=256 * 1024, seed=0) -> bytes:
+    """Big `bin` nodes"""
+    rng = random.Random(seed)
+    root = etree.Element("root")
+    for _ in range(count):
+        node = etree.SubElement(root, "blob", __type="bin")
+        node.text = rng.randbytes(size).hex()
+    return _to_bytes(root)
+
+
+def attributes(count=2000, per_node=8, seed=0) -> bytes:
+    """Void nodes carrying all their data in attributes"""
+    rng = random.Random(seed)
+    root = etree.Element("root")
+    for _ in range(count):
+        attrs = {f"attr{j}": str(rng.randint(0, 99999)) for j in range(per_node)}
+        etree.SubElement(root, "entry", attrs)
+    return _to_bytes(root)
+
+
+CORPUS = {
+    "deep": deep,
+    "wide": wide,
+    "arrays": arrays,
+    "strings": strings,
+    "blobs": blobs,
+    "attributes": attributes,
+}
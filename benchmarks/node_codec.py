@@ -0,0 +1,84 @@
+"""Per-node cost of the struct codec, before and after the precompiled table.
+
+"before" reproduces what ByteBuffer used to do for every value: build the
+format string, then `calcsize` it and let `struct` look it up again.
+"after" is the cached `get_struct` codec that ByteBuffer now uses.
+
+Run from the repository root:
+    python -m benchmarks.node_codec
+"""
+
+import timeit
+from struct import calcsize, pack, unpack_from
+
+from kbinxml import KBinXML
+from kbinxml.bytebuffer import get_struct
+from kbinxml.format_ids import xml_formats, xml_types
+
+# (type name, element count) pairs that cover scalars, vectors and arrays
+SHAPES = [("u8", None), ("s32", None), ("3u8", 1), ("4f", 1), ("s32", 16)]
+NUMBER = 200_000
+
+
+def legacy_decode(data, type, count):
+    fmt = ">" + type if count is None else ">" + str(count) + type
+    ret = unpack_from(fmt, data, 0)
+    size = calcsize(type)
+    if count is not None:
+        size *= count
+    return ret, size
+
+
+def table_decode(data, type, count):
+    codec = get_struct(type, count)
+    return codec.unpack_from(data, 0), codec.size
+
+
+def legacy_encode(values, type, count):
+    fmt = ">" + type if count is None else ">" + str(count) + type
+    return pack(fmt, *values), calcsize(fmt)
+
+
+def table_encode(values, type, count):
+    codec = get_struct(type, count)
+    return codec.pack(*values), codec.size
+
+
+def _ns_per_call(func, *args):
+    timer = timeit.Timer("func(*args)", globals={"func": func, "args": args})
+    return min(timer.repeat(repeat=5, number=NUMBER)) / NUMBER * 1e9
+
+
+def main():
+    print(f"{'shape':<12}{'op':<8}{'before ns':>12}{'after ns':>12}{'speedup':>10}")
+    for name, arrayCount in SHAPES:
+        fmt = xml_formats[xml_types[name]]
+        count = fmt["count"] * (arrayCount or 1)
+        if count == 1:
+            count = None
+        values = [1] * (count or 1)
+        data = pack(">" + str(count or 1) + fmt["type"], *values)
+        label = name if arrayCount is None else f"{name}[{arrayCount}]"
+        for op, before, after, arg in (
+            ("decode", legacy_decode, table_decode, data),
+            ("encode", legacy_encode, table_encode, values),
+        ):
+            old = _ns_per_call(before, arg, fmt["type"], count)
+            new = _ns_per_call(after, arg, fmt["type"], count)
+            print(f"{label:<12}{op:<8}{old:>12.1f}{new:>12.1f}{old / new:>9.2f}x")
+
+    with open("testcases_out.kbin", "rb") as f:
+        kbin = f.read()
+    nodes = sum(1 for _ in KBinXML(kbin).xml_doc.iter())
+    runs = 500
+    decode = timeit.timeit(lambda: KBinXML(kbin), number=runs) / runs
+    doc = KBinXML(kbin)
+    encode = timeit.timeit(doc.to_binary, number=runs) / runs
+    print()
+    print(f"testcases: {nodes} nodes")
+    print(f"  from_binary {decode / nodes * 1e9:10.1f} ns/node")
+    print(f"  to_binary   {encode / nodes * 1e9:10.1f} ns/node")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Timings and peak memory for every operation over the synthetic corpus.
+
+Run from the repository root:
+    python -m benchmarks.suite --save results.json
+    python -m benchmarks.suite --baseline results.json
+
+With `--baseline`, any operation that got slower (or used more memory) than
+the baseline by more than `--threshold` is reported and the exit code is 1.
+Peak memory comes from tracemalloc, so it covers Python allocations only,
+not the C side of lxml.
+Timings are the best of `--repeat` runs, so they are fairly stable on an idle
+machine, but only compare results taken on the same one.
+`import kbinxml` is timed too, in fresh interpreters, as start up matters for
+short lived processes.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from kbinxml import KBinXML
+
+from .corpus import CORPUS
+
+OPERATIONS = ["from_binary", "to_binary", "to_text", "from_text", "mem_size"]
+
+
+def _setups(text: bytes, binary: bytes):
+    """For each operation, a setup function returning the callable to
+    measure. Setup is never timed"""
+
+    def from_binary():
+        return lambda: KBinXML(binary)
+
+    def to_binary():
+        return KBinXML(text).to_binary
+
+    def to_text():
+        return KBinXML(binary).to_text
+
+    def from_text():
+        return lambda: KBinXML(text)
+
+    def mem_size():
+        # a fresh document every run, mem_size is cached after the first call
+        doc = KBinXML(text)
+        return lambda: doc.mem_size
+
+    return {
+        "from_binary": from_binary,
+        "to_binary": to_binary,
+        "to_text": to_text,
+        "from_text": from_text,
+        "mem_size": mem_size,
+    }
+
+
+def _best_time(setup, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        func = setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _peak_memory(setup) -> int:
+    func = setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def import_time(repeat: int) -> float:
+    """Best time to `import kbinxml` in a fresh interpreter"""
+    code = (
+        "import time; start = time.perf_counter(); import kbinxml; "
+        "print(time.perf_counter() - start)"
+    )
+    best = float("inf")
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        best = min(best, float(result.stdout))
+    return best
+
+
+def run(names=None, repeat=5, scale=1.0, operations=None) -> dict:
+    """Benchmark the named corpus documents (all of them by default).
+    `scale` multiplies every document's size parameters"""
+    names = names or list(CORPUS)
+    operations = operations or OPERATIONS
+    results = {}
+    importSeconds = import_time(repeat)
+    print(f"{'import':<25}{importSeconds * 1e3:10.2f} ms", file=sys.stderr)
+    for name in names:
+        generator = CORPUS[name]
+        defaults = generator.__defaults__[:-1]  # everything but the seed
+        sizes = [max(1, int(size * scale)) for size in defaults]
+        text = generator(*sizes)
+        binary = KBinXML(text).to_binary()
+        setups = _setups(text, binary)
+
+        entry = {"xml_bytes": len(text), "kbin_bytes": len(binary)}
+        for op in operations:
+            seconds = _best_time(setups[op], repeat)
+            entry[op] = {"seconds": seconds, "peak_bytes": _peak_memory(setups[op])}
+            print(
+                f"{name:<12}{op:<13}{seconds * 1e3:10.2f} ms"
+                f"{entry[op]['peak_bytes'] / 1e6:10.2f} MB",
+                file=sys.stderr,
+            )
+        results[name] = entry
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "repeat": repeat,
+            "scale": scale,
+        },
+        "import": {"seconds": importSeconds},
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold=0.2) -> list[str]:
+    """Every operation in both result sets whose time or peak memory grew by
+    more than `threshold` (a fraction) over the baseline"""
+    regressions = []
+    if "import" in current and "import" in baseline:
+        old, new = baseline["import"]["seconds"], current["import"]["seconds"]
+        if new > old * (1 + threshold):
+            slowdown = (new / old - 1) * 100
+            regressions.append(
+                f"import seconds: {old:.6g} -> {new:.6g} (+{slowdown:.0f}%)"
+            )
+    for name, entry in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        for op in OPERATIONS:
+            if op not in entry or op not in base:
+                continue
+            for metric in ("seconds", "peak_bytes"):
+                old, new = base[op][metric], entry[op][metric]
+                if old and new > old * (1 + threshold):
+                    regressions.append(
+                        f"{name} {op} {metric}: {old:.6g} -> {new:.6g} "
+                        f"(+{(new / old - 1) * 100:.0f}%)"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark kbinxml on synthetic documents"
+    )
+    parser.add_argument(
+        "--corpus", nargs="+", choices=list(CORPUS), help="documents to run"
+    )
+    parser.add_argument(
+        "--ops", nargs="+", choices=OPERATIONS, help="operations to run"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="runs per timing, best is kept"
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="document size multiplier"
+    )
+    parser.add_argument("--save", metavar="FILE", help="write results as JSON")
+    parser.add_argument(
+        "--baseline", metavar="FILE", help="compare against saved results"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="allowed slowdown before failing, as a fraction (default 0.2)",
+    )
+    args = parser.parse_args()
+
+    results = run(args.corpus, args.repeat, args.scale, args.ops)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("scale") != args.scale:
+            print("warning: baseline was taken at a different --scale", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(
+                f"PERFORMANCE REGRESSION: {len(regressions)} over threshold",
+                file=sys.stderr,
+            )
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+        print("No regressions against baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
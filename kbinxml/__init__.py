@@ -1 +1,15 @@
-from .kbinxml import KBinXML, main
+from .kbinxml import EncodeResult, KBinReader, KBinWriter, KBinXML, iterparse, main
+from .node import KBinNode
+from .lazy import KBinDocument, LazyNode
+from .patch import KBinPatcher, patch_binary
+from .instrument import Instrumentation, get_instrumentation, set_instrumentation
+from .sixbit import configure_name_cache, name_cache_info
+from .stringcache import configure_string_cache, string_cache_info
+from .template import KBinTemplate
+from .emitter import binary_to_text, iter_text, write_text
+from .encoder import encode_text, text_to_binary, write_binary
+from .codec import KBinCodec
+from .cache import EncodeCache, fingerprint
+from .stream import KBinFeedParser, decode_stream, read_document
+from .validate import KBinHeader, inspect_header, validate
+from .transcode import transcode
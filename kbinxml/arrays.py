@@ -0,0 +1,102 @@
+"""Bulk conversion of array node data.
+
+Array values can be returned as tuples (the default), as `array.array`, or as
+read-only NumPy arrays backed by the input buffer when NumPy is installed.
+Encoding accepts any of these, and avoids per-element packing for the latter
+two.
+
+NumPy is slow to import, so it only is once NumPy arrays are asked for.
+Until then, nothing can be a NumPy array.
+"""
+
+import array
+import sys
+
+from .bytebuffer import get_struct
+
+ARRAY_TYPES = (None, "tuple", "array", "numpy")
+
+# kbin data is big endian, array.array is always native
+_needs_swap = sys.byteorder == "little"
+
+# struct type -> array typecode of the same size on this platform
+_typecodes: dict[str, str] = {}
+for _type in "bBhHiIqQfd":
+    for _code in (_type, {"i": "l", "I": "L"}.get(_type)):
+        if _code and array.array(_code).itemsize == get_struct(_type).size:
+            _typecodes[_type] = _code
+            break
+
+
+def get_numpy():
+    """The `numpy` module, or None if it isn't installed"""
+    numpy = sys.modules.get("numpy")
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:  # optional
+            return None
+    return numpy
+
+
+def check_array_type(array_type):
+    if array_type not in ARRAY_TYPES:
+        raise ValueError(f"array_type must be one of {ARRAY_TYPES}")
+    if array_type == "numpy" and get_numpy() is None:
+        raise ValueError('array_type="numpy" requires NumPy to be installed')
+
+
+def unpack_array(data, offset: int, type: str, count: int, array_type=None):
+    """Read `count` big endian `type` values from `data` at `offset`"""
+    if array_type == "numpy":
+        dtype = ">" + type
+        return get_numpy().frombuffer(data, dtype=dtype, count=count, offset=offset)
+    if array_type == "array" and type in _typecodes:
+        size = get_struct(type).size
+        ret = array.array(_typecodes[type])
+        ret.frombytes(data[offset : offset + size * count])
+        if _needs_swap and size > 1:
+            ret.byteswap()
+        return ret
+    return get_struct(type, count).unpack_from(data, offset)
+
+
+def pack_array(type: str, values) -> bytes:
+    """Big endian bytes for a sequence of `type` values"""
+    if isinstance(values, array.array) and values.typecode == _typecodes.get(type):
+        if _needs_swap and values.itemsize > 1:
+            values = array.array(values.typecode, values)
+            values.byteswap()
+        return values.tobytes()
+    # if NumPy was never imported, nothing can be a NumPy array
+    numpy = sys.modules.get("numpy")
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        dtype = numpy.dtype(">" + type)
+        if _fits(numpy, values, dtype):
+            return values.astype(dtype, copy=False).tobytes()
+        # NumPy would wrap around, let struct raise what it does for lists
+        values = values.ravel().tolist()
+    return get_struct(type, len(values)).pack(*values)
+
+
+def _fits(numpy, values, dtype) -> bool:
+    """Whether NumPy converts `values` to `dtype` exactly where struct would"""
+    if numpy.can_cast(values.dtype, dtype):
+        return True
+    kind = values.dtype.kind
+    if dtype.kind == "f":
+        if kind in "biu":
+            return True
+        if kind != "f":
+            return False
+        # struct refuses to overflow to infinity
+        with numpy.errstate(over="ignore"):
+            converted = values.astype(dtype)
+        return not numpy.any(numpy.isinf(converted) & numpy.isfinite(values))
+    if kind not in "biu":
+        # struct only packs integers into integer types
+        return False
+    if not values.size:
+        return True
+    info = numpy.iinfo(dtype)
+    return info.min <= values.min() and values.max() <= info.max
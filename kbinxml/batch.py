@@ -0,0 +1,161 @@
+"""Batch conversion for the kbinxml command line, spread over a process pool
+so interpreter and lxml start-up is only paid once per worker."""
+
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import kbinxml
+from .emitter import binary_to_text
+from .encoder import text_to_binary
+
+
+def _glob_root(pattern: str) -> str:
+    """The directory part of `pattern` before any wildcards"""
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or "."
+
+
+def collect_inputs(patterns: list[str]) -> list[tuple[str, str]]:
+    """Expand files, directories and globs into (path, relative output path)
+    pairs. Directories are walked recursively and keep their structure,
+    plain files are placed by their name alone"""
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for dirpath, _, filenames in os.walk(pattern):
+                for filename in sorted(filenames):
+                    path = os.path.join(dirpath, filename)
+                    found.append((path, os.path.relpath(path, pattern)))
+        elif glob.has_magic(pattern):
+            root = _glob_root(pattern)
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path):
+                    found.append((path, os.path.relpath(path, root)))
+        else:
+            found.append((pattern, os.path.basename(pattern)))
+    return found
+
+
+# extensions swapped for the converted format's, anything else is kept
+_TEXT_EXT = ".xml"
+_BINARY_EXT = ".bin"
+_KNOWN_EXTS = (".xml", ".bin", ".kbin")
+
+
+def output_name(path: str, rel: str) -> str:
+    """`rel` with the extension of what `path` converts to: `.bin` for XML,
+    `.xml` for kbin. Unreadable files keep their name, to fail later"""
+    try:
+        with open(path, "rb") as f:
+            binary = kbinxml.KBinXML.is_binary_xml(f.read(2))
+    except OSError:
+        return rel
+    root, ext = os.path.splitext(rel)
+    if ext.lower() not in _KNOWN_EXTS:
+        root = rel
+    return root + (_TEXT_EXT if binary else _BINARY_EXT)
+
+
+def convert_file(path: str, dest: str, convert_illegal=False):
+    """Convert one file, kbin to xml or xml to kbin. Returns
+    (path, input size, output size, error message or None)"""
+    kbinxml.convert_illegal_help = "add the --convert-illegal flag"
+    tmp = None
+    try:
+        with open(path, "rb") as f:
+            input = f.read()
+        if kbinxml.KBinXML.is_binary_xml(input):
+            output = binary_to_text(input, convert_illegal).encode("utf-8")
+        else:
+            output = text_to_binary(input)
+
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        # write then rename, so in place conversion never leaves half a file
+        tmp = f"{dest}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(output)
+        os.replace(tmp, dest)
+    except Exception as e:
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+        return path, 0, 0, f"{type(e).__name__}: {e}"
+    return path, len(input), len(output), None
+
+
+def _convert_job(job):
+    return convert_file(*job)
+
+
+def run_batch(patterns, output_dir=None, jobs=None, convert_illegal=False) -> int:
+    """Convert everything matching `patterns`, into `output_dir` or in place
+    if it's None. Failures are reported without stopping the run. Returns
+    the process exit code"""
+    inputs = collect_inputs(patterns)
+    if not inputs:
+        print("kbinxml: no input files found", file=sys.stderr)
+        return 1
+
+    targets = []
+    outputs = {}
+    for path, rel in inputs:
+        if output_dir is None:
+            dest = path
+        else:
+            dest = os.path.join(output_dir, output_name(path, rel))
+        key = os.path.normcase(os.path.abspath(dest))
+        outputs[key] = outputs.get(key, 0) + 1
+        targets.append((path, dest, key))
+
+    # inputs sharing an output would overwrite each other (or, in place, be
+    # converted twice), so none of them are converted
+    failed = 0
+    work = []
+    for path, dest, key in targets:
+        if outputs[key] > 1:
+            failed += 1
+            print(
+                f"kbinxml: {path}: {dest} is also the output of another input",
+                file=sys.stderr,
+            )
+        else:
+            work.append((path, dest, convert_illegal))
+
+    jobs = jobs or os.cpu_count() or 1
+    start = time.perf_counter()
+    if jobs == 1 or len(work) <= 1:
+        results = map(_convert_job, work)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        chunksize = max(1, min(64, len(work) // (jobs * 4)))
+        results = pool.map(_convert_job, work, chunksize=chunksize)
+
+    converted = bytes_in = bytes_out = 0
+    try:
+        for path, size_in, size_out, error in results:
+            if error is None:
+                converted += 1
+                bytes_in += size_in
+                bytes_out += size_out
+            else:
+                failed += 1
+                print(f"kbinxml: {path}: {error}", file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    mb_in, mb_out = bytes_in / 1e6, bytes_out / 1e6
+    print(
+        f"Converted {converted} files ({mb_in:.2f} MB -> {mb_out:.2f} MB) "
+        f"in {elapsed:.2f}s: {converted / elapsed:.1f} files/s, "
+        f"{mb_in / elapsed:.2f} MB/s, {failed} failed"
+    )
+    return 1 if failed else 0
@@ -1,78 +1,135 @@
-from struct import *
+from functools import lru_cache
+from struct import Struct
 from typing import Any
 
 
+@lru_cache(maxsize=1024)
+def get_struct(type: str, count: int | None = None, endian: str = ">") -> Struct:
+    """Precompiled codec for `count` values of `type`. Cached, so repeated
+    reads/writes of the same shape never rebuild the format string"""
+    if count is None:
+        return Struct(endian + type)
+    return Struct(endian + str(count) + type)
+
+
 class ByteBuffer:
-    def __init__(self, input: bytes | bytearray | str = b"", offset=0, endian=">"):
+    """Reads from `data` at `offset`, and appends to it at `end`, the end of
+    the content (and what `len()` gives). Appending also moves `offset` on,
+    so it follows the end of a buffer that is only being written.
+
+    Input that isn't a bytearray (bytes, memoryview, mmap...) is read in
+    place, and copied into a bytearray the first time it's written to.
+    Writes grow the bytearray geometrically and never shrink it, so `data`
+    can be longer than the content (use `getbuffer` for just that). This
+    lets a bytearray be reused without reallocating: pass `end=0` to write
+    over what it holds"""
+
+    def __init__(self, input=None, offset=0, endian=">", end=None):
         # so multiple ByteBuffers can hold on to one set of underlying data
         # this is useful for writers in multiple locations
-        if isinstance(input, bytearray):
+        if input is None:
+            self.data = bytearray()
+        elif isinstance(input, bytearray):
             self.data = input
+        elif isinstance(input, str):
+            self.data = bytearray(input.encode("utf-8"))
         else:
-            if not isinstance(input, bytes):
-                input = input.encode("utf-8")
-            self.data = bytearray(input)
+            # bytes, memoryview, mmap etc are usually only read, so don't copy
+            self.data = memoryview(input).cast("B")
         self.endian = endian
         self.offset = offset
-        self.end = len(self.data)
-
-    def _format_type(self, type: str, count: int | None = None):
-        if count is None:
-            return self.endian + type
-        else:
-            return self.endian + str(count) + type
+        self.end = len(self.data) if end is None else end
+        # how far writes can go without `reserve`, none at all into a view
+        self.capacity = len(self.data) if isinstance(self.data, bytearray) else 0
 
     def get_bytes(self, count: int):
+        """A slice of the data. This is a view, not a copy, for read-only
+        buffers, so convert it with `bytes()` if it needs to outlive them"""
         start = self.offset
         self.offset += count
         return self.data[start : self.offset]
 
     def get(self, type: str, count: int | None = None):
-        ret = self.peek(type, count)
-        size = calcsize(type)
-        if count is not None:
-            size *= count
-        self.offset += size
-        return ret
+        codec = get_struct(type, count, self.endian)
+        ret = codec.unpack_from(self.data, self.offset)
+        self.offset += codec.size
+        return ret[0] if count is None else ret
 
     def peek(self, type: str, count: int | None = None):
-        fmt = self._format_type(type, count)
-        ret = unpack_from(fmt, self.data, self.offset)
+        ret = get_struct(type, count, self.endian).unpack_from(self.data, self.offset)
         return ret[0] if count is None else ret
 
+    def reserve(self, end: int):
+        """Make sure `data` is a bytearray at least `end` bytes long"""
+        data = self.data
+        if not isinstance(data, bytearray):
+            self.data = bytearray(data)
+            data.release()
+            data = self.data
+        if end > len(data):
+            # at least double, so a run of appends is amortised
+            data.extend(bytes(max(end - len(data), len(data), 64)))
+        self.capacity = len(data)
+
     def append_bytes(self, data: bytes):
-        self.data.extend(data)
+        start = self.end
+        self.end = end = start + len(data)
+        if end > self.capacity:
+            self.reserve(end)
+        self.data[start:end] = data
         self.offset += len(data)
 
     def append(self, data: Any, type: str, count: int | None = None):
-        fmt = self._format_type(type, count)
-        self.offset += calcsize(fmt)
+        codec = get_struct(type, count, self.endian)
+        start = self.end
+        self.end = end = start + codec.size
+        if end > self.capacity:
+            self.reserve(end)
         try:
-            self.data.extend(pack(fmt, *data))
+            codec.pack_into(self.data, start, *data)
         except TypeError:
-            self.data.extend(pack(fmt, data))
+            codec.pack_into(self.data, start, data)
+        self.offset += codec.size
 
     def set(self, data: Any, offset: int, type: str, count: int | None = None):
-        fmt = self._format_type(type, count)
+        codec = get_struct(type, count, self.endian)
+        end = offset + codec.size
+        if end > self.end:
+            if end > self.capacity:
+                self.reserve(end)
+            self.end = end
+        elif not self.capacity:
+            self.reserve(end)
         try:
-            pack_into(fmt, self.data, offset, *data)
+            codec.pack_into(self.data, offset, *data)
         except TypeError:
-            pack_into(fmt, self.data, offset, data)
-        self.offset += calcsize(fmt)
+            codec.pack_into(self.data, offset, data)
+        self.offset += codec.size
 
     def hasData(self):
         return self.offset < self.end
 
     def realign_writes(self, size=4):
-        while len(self) % size:
-            self.append_u8(0)
+        padding = -self.end % size
+        if padding:
+            self.append_bytes(bytes(padding))
 
     def realign_reads(self, size=4):
-        while self.offset % size:
-            self.offset += 1
+        self.offset += -self.offset % size
 
     def __len__(self):
-        return len(self.data)
+        return self.end
+
+    def getbuffer(self) -> memoryview:
+        """A view of the content. Release it before writing again, a
+        bytearray can't grow while it's exported"""
+        return memoryview(self.data)[: self.end]
+
+    def release(self):
+        """Let go of a read-only view, so the underlying buffer (eg an mmap)
+        can be closed"""
+        if isinstance(self.data, memoryview):
+            self.data.release()
 
     def get_s8(self) -> int:
         return self.get("b")
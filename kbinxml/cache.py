@@ -0,0 +1,226 @@
+import threading
+from collections import OrderedDict
+
+from .kbinxml import BIN_ENCODING, KBinXML
+from .node import KBinNode
+from .xmlsupport import get_etree, is_element_tree
+
+# structure markers. The parts are hashed as the repr of their list, which
+# quotes each one, so no name or value can pass for a marker or a boundary
+_START = "\x01"
+_ATTR = "\x02"
+_TEXT = "\x03"
+_END = "\x04"
+
+
+def _element_parts(root, parts):
+    # the same walk, and the same inputs, as `_element_to_binary`
+    Element = get_etree().Element
+    stack = [iter((root,))]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            parts.append(_END)
+            continue
+        parts.append(_START)
+        parts.append(node.tag)
+        for key, value in sorted(node.attrib.items()):
+            parts += (_ATTR, key, _ATTR, value)
+        parts.append(_TEXT)
+        parts.append(node.text or "")
+        stack.append(node.iterchildren(tag=Element))
+
+
+def _text_parts(root, parts):
+    # everything `to_text` writes out, in document order: comments and PIs,
+    # namespace declarations, unsorted attributes and the text around nodes
+    stack = [iter((root,))]
+    nsmaps = [{}]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            nsmaps.pop()
+            parts.append(_END)
+            continue
+        parts.append(_START)
+        if isinstance(node.tag, str):
+            parts.append(node.tag)
+            nsmap = node.nsmap
+            declared = nsmaps[-1].items()
+            parts.append([item for item in nsmap.items() if item not in declared])
+            for key, value in node.attrib.items():
+                parts += (_ATTR, key, _ATTR, value)
+        else:
+            # a comment, processing instruction or entity
+            parts.append(type(node).__name__)
+            parts.append(getattr(node, "target", None))
+            nsmap = nsmaps[-1]
+        parts += (_TEXT, node.text, _TEXT, node.tail)
+        stack.append(node.iterchildren())
+        nsmaps.append(nsmap)
+
+
+def _node_parts(root: KBinNode, parts):
+    stack = [iter((root,))]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            parts.append(_END)
+            continue
+        value = node.value
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            value = bytes(value).hex()
+        elif not isinstance(value, (str, int, float)) and value is not None:
+            if hasattr(value, "tolist"):
+                # array.array and NumPy values, as NumPy's repr depends on the
+                # dtype and print options
+                value = value.tolist()
+            if not isinstance(value, (int, float)):
+                value = tuple(value)
+        parts += (_START, node.name, _TEXT, f"{node.type} {node.is_array} {value!r}")
+        for key, value in sorted(node.attrs.items()):
+            parts += (_ATTR, key, _ATTR, value)
+        stack.append(iter(node.children))
+
+
+def fingerprint(source) -> bytes:
+    """A 16 byte digest of everything that affects how `source` (a
+    `KBinXML`, an lxml element or tree, or a `KBinNode`) encodes: names,
+    types, values and attributes (sorted, as they are encoded). Comments
+    and text between elements are ignored, like they are when encoding.
+
+    Equal trees have equal fingerprints. An lxml tree and a `KBinNode` of
+    the same document don't, as their values aren't kept the same way."""
+    if isinstance(source, KBinNode):
+        parts = ["node"]
+        _node_parts(source, parts)
+    else:
+        parts = ["element"]
+        _element_parts(_root(source), parts)
+    return _digest(parts)
+
+
+def _text_fingerprint(source) -> bytes:
+    """Like `fingerprint`, but of everything that affects `to_text`, which
+    includes what encoding ignores"""
+    if isinstance(source, KBinNode):
+        # its element, and so its text, only depends on what it encodes
+        return fingerprint(source)
+    parts = ["text"]
+    _text_parts(_root(source), parts)
+    return _digest(parts)
+
+
+def _root(source):
+    if isinstance(source, KBinXML):
+        return source.xml_doc
+    if is_element_tree(source):
+        return source.getroot()
+    return source
+
+
+def _digest(parts) -> bytes:
+    # hashlib loads OpenSSL, which is slow to import
+    from hashlib import blake2b
+
+    return blake2b(repr(parts).encode("utf-8"), digest_size=16).digest()
+
+
+class EncodeCache:
+    """Remembers encoded documents by `fingerprint`, so encoding a tree
+    identical to an earlier one only costs hashing it. Text from `to_text`
+    is cached the same way, by a stricter fingerprint that also covers the
+    comments, namespaces, attribute order and whitespace that end up in it.
+
+    The least recently used entries are evicted once there are more than
+    `maxsize` of them, or they add up to more than `max_bytes` (None for no
+    limit). `hits`, `misses` and `evictions` count what happened. Safe to
+    share between threads."""
+
+    def __init__(self, maxsize=1024, max_bytes=64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.currbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, key, make, size):
+        with self._lock:
+            found = self._entries.get(key)
+            if found is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return found[0]
+            self.misses += 1
+
+        # outside the lock, a slow encode shouldn't hold up other threads
+        result = make()
+        resultSize = size(result)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (result, resultSize)
+                self.currbytes += resultSize
+                self._evict()
+        return result
+
+    def _evict(self):
+        entries = self._entries
+        while entries and (
+            len(entries) > self.maxsize
+            or (self.max_bytes is not None and self.currbytes > self.max_bytes)
+        ):
+            _, (_, size) = entries.popitem(last=False)
+            self.currbytes -= size
+            self.evictions += 1
+
+    def encode(self, source, encoding=BIN_ENCODING, compressed=True) -> bytes:
+        """`source` encoded, as by its `to_binary`"""
+        key = (fingerprint(source), encoding, compressed)
+        return self._lookup(key, lambda: _to_binary(source, encoding, compressed), len)
+
+    def to_text(self, source) -> str:
+        """`source` as XML text, as by `KBinXML.to_text`"""
+        key = (_text_fingerprint(source), "text")
+        # count characters as 4 bytes, the most they can take
+        return self._lookup(key, lambda: _to_text(source), lambda text: len(text) * 4)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.currbytes = 0
+
+    def info(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "currsize": len(self._entries),
+            "currbytes": self.currbytes,
+            "maxsize": self.maxsize,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def _to_binary(source, encoding, compressed) -> bytes:
+    if isinstance(source, (KBinNode, KBinXML)):
+        return source.to_binary(encoding, compressed)
+    return KBinXML(source).to_binary(encoding, compressed)
+
+
+def _to_text(source) -> str:
+    if isinstance(source, KBinNode):
+        source = source.to_element()
+    if isinstance(source, KBinXML):
+        return source.to_text()
+    return KBinXML(source).to_text()
@@ -0,0 +1,93 @@
+import threading
+
+from .encoder import _parse_into
+from .kbinxml import BIN_ENCODING, KBinWriter, KBinXML, _element_to_binary
+from .node import KBinNode
+from .xmlsupport import is_element, is_element_tree
+
+# starting size of pooled buffers, they grow to fit the biggest document
+INITIAL_BUFFER_SIZE = 16 * 1024
+
+
+class _BufferPool(threading.local):
+    """Spare (node section, data section) bytearray pairs, per thread"""
+
+    def __init__(self):
+        self.free = []
+
+
+class KBinCodec:
+    """Encoder and decoder that only holds settings, so a single instance
+    can be shared by any number of threads (free-threaded builds included).
+
+    Each thread keeps a small pool of buffers that encoding writes into.
+    They keep whatever size they grew to, so steady traffic of similar
+    documents stops allocating working memory. Buffers that grew past
+    `max_buffer_size` are dropped instead of pooled, so one huge document
+    doesn't pin its memory forever.
+    """
+
+    def __init__(
+        self,
+        encoding=BIN_ENCODING,
+        compressed=True,
+        convert_illegal_things=False,
+        pool_size=4,
+        max_buffer_size=16 * 1024 * 1024,
+    ):
+        self.encoding = encoding
+        self.compressed = compressed
+        self.convert_illegal_things = convert_illegal_things
+        self.pool_size = pool_size
+        self.max_buffer_size = max_buffer_size
+        self._pool = _BufferPool()
+
+    def _acquire(self):
+        free = self._pool.free
+        if free:
+            return free.pop()
+        return bytearray(INITIAL_BUFFER_SIZE), bytearray(INITIAL_BUFFER_SIZE)
+
+    def _release(self, buffers):
+        free = self._pool.free
+        size = max(map(len, buffers))
+        if len(free) < self.pool_size and size <= self.max_buffer_size:
+            free.append(buffers)
+
+    def _encode(self, source, finish):
+        buffers = self._acquire()
+        try:
+            writer = KBinWriter(self.encoding, self.compressed, buffers=buffers)
+            if isinstance(source, KBinNode):
+                source.write(writer)
+            elif isinstance(source, KBinXML):
+                _element_to_binary(source.xml_doc, writer)
+            elif is_element_tree(source):
+                _element_to_binary(source.getroot(), writer)
+            elif is_element(source):
+                _element_to_binary(source, writer)
+            else:
+                _parse_into(source, writer)
+            return finish(writer)
+        finally:
+            self._release(buffers)
+
+    def encode(self, source) -> bytes:
+        """Encode an lxml element or tree, a `KBinXML`, a `KBinNode`, or XML
+        text (bytes or a binary file, which is encoded without a tree). Only
+        `KBinNode`s are encoded without lxml"""
+        return self._encode(source, KBinWriter.finish)
+
+    def encode_into(self, source, buffer, offset=0) -> int:
+        """Encode `source` (as for `encode`) into `buffer` at `offset`.
+        Returns the number of bytes written"""
+        return self._encode(source, lambda writer: writer.finish_into(buffer, offset))
+
+    def decode(self, data) -> KBinXML:
+        """Decode a binary (or parse XML text) into a new `KBinXML`. This
+        needs lxml, `decode_node` doesn't"""
+        return KBinXML(data, self.convert_illegal_things)
+
+    def decode_node(self, data, array_type=None) -> KBinNode:
+        """Decode a binary into a `KBinNode` tree"""
+        return KBinNode.from_binary(data, self.convert_illegal_things, array_type)
@@ -0,0 +1,290 @@
+"""Binary to XML text without building a tree.
+
+The output is identical to `KBinXML(input).to_text()`, including how lxml
+pretty prints (elements holding text are never indented inside) and the
+way `KBinXML` handles serialised namespaces.
+"""
+
+import re
+from functools import lru_cache
+
+from . import kbinxml
+from .format_ids import format_values, xml_formats
+from .kbinxml import BINARY, NODE_START, STRING, KBinException, KBinReader
+from .xmlsupport import get_etree
+
+XML_DECLARATION = "<?xml version='1.0' encoding='UTF-8'?>\n"
+# libxml2 stops indenting deeper than this
+_MAX_INDENT = 60
+# part count at which `iter_text` hands over a chunk
+_CHUNK_PARTS = 2048
+
+XML_NAMESPACE = "http://www.w3.org/XML/1998/namespace"
+
+# characters lxml refuses to put in a document. Spelled out rather than as
+# the inverse of the valid ranges, which takes ten times longer to compile
+_invalid_chars = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+_text_special = re.compile("[&<>\r]")
+_attr_special = re.compile('[&<>"\n\r\t]')
+
+
+def _escape_text(text: str) -> str:
+    if _text_special.search(text) is None:
+        return text
+    return (
+        text.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace("\r", "&#13;")
+    )
+
+
+def _escape_attr(value: str) -> str:
+    if _attr_special.search(value) is None:
+        return value
+    return (
+        value.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+        .replace("\n", "&#10;")
+        .replace("\r", "&#13;")
+        .replace("\t", "&#9;")
+    )
+
+
+def _check_string(string: str) -> str:
+    if _invalid_chars.search(string) is not None:
+        raise ValueError(
+            "All strings must be XML compatible: Unicode or ASCII, no NULL bytes or "
+            "control characters"
+        )
+    return string
+
+
+@lru_cache(1024)
+def _valid_name(name: str) -> bool:
+    # exactly lxml's rules, the names are cached so this is rarely run
+    try:
+        get_etree().Element(name)
+    except ValueError:
+        return False
+    return True
+
+
+class _Element:
+    __slots__ = ("tag", "attrs", "text", "nsdefs")
+
+    def __init__(self, tag):
+        self.tag = tag
+        # key -> (name as written, value), in the order lxml would keep them
+        self.attrs = {}
+        self.text = None
+        self.nsdefs = []
+
+
+class _Emitter:
+    def __init__(self, convert_illegal_things):
+        self.convert_illegal_things = convert_illegal_things
+        self.parts = []
+        # open elements already written: (element, parent's format, format)
+        self.stack = []
+        self.pending = None
+        # whether the children of the innermost open element are indented
+        self.format = True
+        self.closed = False
+
+    def tag_name(self, name):
+        if _valid_name(name):
+            return name
+        fixed_name = f"_{name}"
+        if not self.convert_illegal_things:
+            raise KBinException(
+                f'Could not create node with name "{name}". To rename it to '
+                f'"{fixed_name}", {kbinxml.convert_illegal_help}.'
+            )
+        if not _valid_name(fixed_name):
+            raise ValueError(f"Invalid tag name {fixed_name!r}")
+        return fixed_name
+
+    def nsmap(self) -> dict:
+        """In scope namespaces of the pending element, as lxml's `nsmap`"""
+        nsmap = {}
+        for prefix, uri in self.pending.nsdefs:
+            nsmap.setdefault(prefix, uri)
+        for element, _, _ in reversed(self.stack):
+            for prefix, uri in element.nsdefs:
+                nsmap.setdefault(prefix, uri)
+        return nsmap
+
+    def _find_href(self, uri, elements):
+        """Prefix of the closest declaration of `uri` in `elements`
+        (innermost first), skipping ones whose prefix is redeclared closer"""
+        if uri == XML_NAMESPACE:
+            return "xml"
+        seen = set()
+        for element in elements:
+            for prefix, href in element.nsdefs:
+                if href == uri and prefix not in seen:
+                    return prefix
+            seen.update(prefix for prefix, _ in element.nsdefs)
+        return None
+
+    def add_namespace(self, prefix, uri):
+        # KBinXML._add_namespace recreates the element with all the in scope
+        # namespaces declared on it, losing its attributes and text. Once
+        # it's back in the tree, lxml drops declarations of any namespace
+        # its ancestors already declare
+        nsmap = self.nsmap()
+        nsmap[prefix] = uri
+        get_etree().Element("ns", nsmap=nsmap)  # same validation
+        ancestors = [element for element, _, _ in reversed(self.stack)]
+        element = self.pending
+        element.nsdefs = [
+            (p, u) for p, u in nsmap.items() if self._find_href(u, ancestors) is None
+        ]
+        element.attrs = {}
+        element.text = None
+
+    def attribute(self, name, value):
+        element = self.pending
+        if name.startswith("xmlns:"):
+            _, name = name.split("xmlns:")
+            self.add_namespace(name, _check_string(value))
+        elif ":" in name:
+            prefix, name = name.split(":")
+            uri = self.nsmap()[prefix]
+            key = get_etree().QName(uri, name).text
+            _check_string(value)
+            ancestors = [element] + [e for e, _, _ in reversed(self.stack)]
+            written = f"{self._find_href(uri, ancestors)}:{name}"
+            element.attrs[key] = (element.attrs.get(key, (written,))[0], value)
+        else:
+            if not _valid_name(name):
+                raise ValueError(f"Invalid attribute name {name!r}")
+            element.attrs[name] = (name, _check_string(value))
+
+    def start_tag(self, element) -> str:
+        parts = [f"<{element.tag}"]
+        for prefix, uri in element.nsdefs:
+            parts.append(f' xmlns:{prefix}="{_escape_attr(uri)}"')
+        for written, value in element.attrs.values():
+            parts.append(f' {written}="{_escape_attr(value)}"')
+        return "".join(parts)
+
+    def indent(self, level):
+        return " " * min(level * 2, _MAX_INDENT)
+
+    def flush(self, has_children):
+        element = self.pending
+        self.pending = None
+        parts = self.parts
+        level = len(self.stack)
+        if self.format and level:
+            parts.append(self.indent(level))
+        parts.append(self.start_tag(element))
+
+        text = element.text
+        if not has_children:
+            if text is None:
+                parts.append("/>")
+            else:
+                parts.append(f">{text}</{element.tag}>")
+            if self.format and level:
+                parts.append("\n")
+            elif not level:
+                self.closed = True
+            return
+
+        # like libxml2, never add whitespace to an element that has text
+        childFormat = self.format and text is None
+        parts.append(">")
+        if text:
+            parts.append(text)
+        if childFormat:
+            parts.append("\n")
+        self.stack.append((element, self.format, childFormat))
+        self.format = childFormat
+
+    def end(self):
+        if self.pending is not None:
+            self.flush(False)
+            return
+        element, parentFormat, childFormat = self.stack.pop()
+        level = len(self.stack)
+        parts = self.parts
+        if childFormat:
+            parts.append(self.indent(level))
+        parts.append(f"</{element.tag}>")
+        self.format = parentFormat
+        if parentFormat and level:
+            parts.append("\n")
+        elif not level:
+            self.closed = True
+
+
+def iter_text(input, convert_illegal_things=False, instrumentation=None):
+    """Decode a binary straight to XML text, yielding it in chunks. Joined,
+    the chunks equal `KBinXML(input).to_text()`. Memory use doesn't grow
+    with the document, only with its largest value"""
+    reader = KBinReader(input, convert_illegal_things, instrumentation=instrumentation)
+    emitter = _Emitter(convert_illegal_things)
+    parts = emitter.parts
+    finished = False
+    yield XML_DECLARATION
+
+    for event in reader.events():
+        kind = event[0]
+        if kind == "start":
+            _, name, nodeType, isArray = event
+            if emitter.pending is not None:
+                emitter.flush(True)
+            element = emitter.pending = _Element(emitter.tag_name(name))
+            if nodeType != NODE_START:
+                nodeFormat = xml_formats[nodeType]
+                element.attrs["__type"] = ("__type", nodeFormat["name"])
+        elif kind == "value":
+            data = event[1]
+            if nodeType == BINARY:
+                element.attrs["__size"] = ("__size", str(len(data)))
+                string = data.hex()
+            elif nodeType == STRING:
+                string = _escape_text(_check_string(data.strip("\0")))
+            else:
+                if nodeFormat["count"] == 1 and not isArray:
+                    data = (data,)
+                elif isArray:
+                    count = len(data) // nodeFormat["count"]
+                    element.attrs["__count"] = ("__count", str(count))
+                string = format_values(nodeFormat, data)
+            element.text = string
+        elif kind == "attr":
+            emitter.attribute(event[1], event[2])
+        else:  # end
+            emitter.end()
+
+        if emitter.closed:
+            # KBinXML only keeps the first root, but still checks the rest
+            if not finished:
+                yield "".join(parts)
+                finished = True
+            emitter.parts = parts = []
+        elif len(parts) >= _CHUNK_PARTS:
+            yield "".join(parts)
+            parts.clear()
+
+    reader.close()
+    if not finished:
+        raise KBinException("kbin document has no nodes")
+    yield "\n"
+
+
+def write_text(input, file, convert_illegal_things=False, instrumentation=None):
+    """Decode a binary straight into `file` as UTF-8 XML, see `iter_text`"""
+    for chunk in iter_text(input, convert_illegal_things, instrumentation):
+        file.write(chunk.encode("utf-8"))
+
+
+def binary_to_text(input, convert_illegal_things=False, instrumentation=None) -> str:
+    """`KBinXML(input).to_text()`, without building the tree"""
+    return "".join(iter_text(input, convert_illegal_things, instrumentation))
@@ -0,0 +1,82 @@
+"""XML text to binary without building a tree.
+
+lxml's parser calls straight into a `KBinWriter` as elements are read, so
+memory only holds the output and never the document. The output is
+identical to `KBinXML(input).to_binary()`.
+"""
+
+from .kbinxml import BIN_ENCODING, EncodeResult, KBinWriter, _start_element
+from .xmlsupport import get_etree
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _EncodeTarget:
+    """lxml parser target writing each element as soon as its text is
+    complete, which is at its first child, comment or processing
+    instruction, or its end. Anything after that is tail text, which
+    `KBinXML` ignores too"""
+
+    def __init__(self, writer: KBinWriter):
+        self.writer = writer
+        self.pending = None
+        self.text = []
+
+    def _flush(self):
+        if self.pending is not None:
+            tag, attrib = self.pending
+            self.pending = None
+            text = "".join(self.text) if self.text else None
+            self.text.clear()
+            _start_element(self.writer, tag, attrib, text)
+
+    def start(self, tag, attrib):
+        self._flush()
+        self.pending = (tag, attrib)
+
+    def data(self, data):
+        if self.pending is not None:
+            self.text.append(data)
+
+    def end(self, tag):
+        self._flush()
+        self.writer.end()
+
+    def comment(self, text):
+        self._flush()
+
+    def pi(self, target, data):
+        self._flush()
+
+    def close(self):
+        return self.writer
+
+
+def _parse_into(source, writer: KBinWriter):
+    parser = get_etree().XMLParser(target=_EncodeTarget(writer))
+    if hasattr(source, "read"):
+        while chunk := source.read(CHUNK_SIZE):
+            parser.feed(chunk)
+    else:
+        parser.feed(source)
+    parser.close()
+
+
+def encode_text(source, encoding=BIN_ENCODING, compressed=True) -> EncodeResult:
+    """Encode XML text, given as bytes or a file opened in binary mode. Like
+    `KBinXML(source).encode(encoding, compressed)`, without the tree"""
+    writer = KBinWriter(encoding, compressed)
+    _parse_into(source, writer)
+    binary = writer.finish()
+    return EncodeResult(binary, writer.mem_size, writer.nodeCount, writer.dataMemSize)
+
+
+def text_to_binary(source, encoding=BIN_ENCODING, compressed=True) -> bytes:
+    return encode_text(source, encoding, compressed).binary
+
+
+def write_binary(source, file, encoding=BIN_ENCODING, compressed=True):
+    """Encode XML text from `source` straight into `file`"""
+    writer = KBinWriter(encoding, compressed)
+    _parse_into(source, writer)
+    writer.finish(file)
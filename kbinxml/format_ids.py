@@ -1,4 +1,6 @@
-from struct import pack, unpack
+from struct import calcsize, pack, unpack
+
+from .bytebuffer import get_struct
 
 
 def parseIP(string: str) -> int:
@@ -93,3 +95,27 @@ for key, val in xml_formats.items():
 xml_types["nodeStart"] = 1
 xml_types["nodeEnd"] = 190
 xml_types["endSection"] = 191
+
+# precompiled codecs, so encode/decode never rebuild format strings per node.
+# `size` is a single element, `struct` is one whole (non-array) value.
+# Arrays and variable length types go through the cached `get_struct`.
+# `textFmt` lets `format_values` print every element in a single % operation
+for val in xml_formats.values():
+    if "type" in val:
+        val["size"] = calcsize(val["type"])
+        if val["count"] > 0:
+            val["struct"] = get_struct(val["type"], val["count"])
+            if "toStr" not in val:
+                val["textFmt"] = "%d"
+            elif val["toStr"] is writeFloat:
+                val["textFmt"] = "%.6f"
+
+
+def format_values(fmt: dict, values) -> str:
+    """Space separated text for a sequence of values of type `fmt`"""
+    textFmt = fmt.get("textFmt")
+    if textFmt is None:
+        return " ".join(map(fmt.get("toStr", str), values))
+    if not isinstance(values, tuple):
+        values = tuple(values)
+    return " ".join((textFmt,) * len(values)) % values
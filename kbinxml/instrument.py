@@ -0,0 +1,110 @@
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+from .format_ids import xml_formats
+
+_default = None
+_no_phase = nullcontext()
+
+
+class Instrumentation:
+    """Records where conversions spend their time. Pass one to `KBinXML`,
+    `KBinReader` or `KBinWriter`, or install one for everything with
+    `set_instrumentation`. Totals accumulate until `reset`.
+
+    - `phases`: seconds spent in each phase, and `calls` per phase. Whole
+      conversions are "from_binary", "to_binary", "from_text", "to_text"
+      and "feed" (per `KBinFeedParser.feed` call); inside those,
+      "node_names", "data_reads"/"data_writes" and "strings" (which includes
+      reading the string's bytes)
+    - `node_types`: nodes read or written, by type name
+    - `bytes_read`/`bytes_written`: bytes per section ("header", "node", "data")
+    - `string_fallbacks`: strings that only decoded with the utf-8 fallback
+
+    To forward to your own metrics as things happen, subclass and override
+    the `record_*` methods. Otherwise read `snapshot()` afterwards.
+    When no instrumentation is in use, nothing is wrapped or timed.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.phases = defaultdict(float)
+        self.calls = Counter()
+        self.node_types = Counter()
+        self.bytes_read = Counter()
+        self.bytes_written = Counter()
+        self.string_fallbacks = 0
+
+    def record_phase(self, phase: str, seconds: float):
+        self.phases[phase] += seconds
+        self.calls[phase] += 1
+
+    def record_node(self, type_id: int):
+        self.node_types[xml_formats[type_id]["name"]] += 1
+
+    def record_bytes(self, direction: str, section: str, count: int):
+        """`direction` is "read" or "written" """
+        if direction == "read":
+            self.bytes_read[section] += count
+        else:
+            self.bytes_written[section] += count
+
+    def record_fallback(self, data: bytes):
+        self.string_fallbacks += 1
+
+    @contextmanager
+    def phase(self, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(phase, time.perf_counter() - start)
+
+    def timed(self, phase: str, func):
+        """Wrap `func` so every call counts towards `phase`"""
+        perf_counter = time.perf_counter
+
+        def timed(*args):
+            start = perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.record_phase(phase, perf_counter() - start)
+
+        return timed
+
+    def snapshot(self) -> dict:
+        """Everything recorded so far, as plain dicts"""
+        return {
+            "phases": {
+                phase: {"seconds": seconds, "calls": self.calls[phase]}
+                for phase, seconds in self.phases.items()
+            },
+            "node_types": dict(self.node_types),
+            "bytes_read": dict(self.bytes_read),
+            "bytes_written": dict(self.bytes_written),
+            "string_fallbacks": self.string_fallbacks,
+        }
+
+
+def set_instrumentation(instrumentation: Instrumentation | None):
+    """Use `instrumentation` wherever one isn't passed explicitly. None turns
+    it off again. Returns the previous one"""
+    global _default
+    previous, _default = _default, instrumentation
+    return previous
+
+
+def get_instrumentation(instrumentation=None) -> Instrumentation | None:
+    """`instrumentation` if given, otherwise the global one"""
+    return _default if instrumentation is None else instrumentation
+
+
+def phase(instrumentation: Instrumentation | None, name: str):
+    """Time a block as `name` if `instrumentation` is on"""
+    if instrumentation is None:
+        return _no_phase
+    return instrumentation.phase(name)
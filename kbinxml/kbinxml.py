@@ -1,17 +1,17 @@
-import argparse
+import mmap
 import operator
 import sys
 from io import BytesIO
-from struct import calcsize
-
-import lxml.etree as etree
-
-from .bytebuffer import ByteBuffer
-from .format_ids import xml_formats, xml_types
+from typing import NamedTuple
+
+from .bytebuffer import ByteBuffer, get_struct
+from .arrays import check_array_type, pack_array, unpack_array
+from .format_ids import format_values, xml_formats, xml_types
+from . import sixbit, stringcache
+from .instrument import get_instrumentation, phase
+from .layout import DataLayout
 from .sixbit import pack_sixbit, unpack_sixbit
-
-DEBUG_OFFSETS = False
-DEBUG = False
+from .xmlsupport import get_etree, is_element, is_element_tree
 
 SIGNATURE = 0xA0
 
@@ -35,197 +35,262 @@ encoding_vals = {val: key for key, val in encoding_strings.items()}
 # ensure that duplicated value from above is correct. Avoid exporting 0x00 type
 encoding_vals["cp932"] = 0x80
 
+NODE_START = xml_types["nodeStart"]
+NODE_END = xml_types["nodeEnd"]
+END_SECTION = xml_types["endSection"]
+ATTR = xml_types["attr"]
+BINARY = xml_types["binary"]
+STRING = xml_types["string"]
 
-def debug_print(string):
-    if DEBUG:
-        print(string)
+# signature, compression, encoding, inverted encoding, node section length
+_header = get_struct("BBBBI")
+# section and value lengths
+_u32 = get_struct("I")
 
 
 class KBinException(Exception):
     pass
 
 
+class KBinHeader(NamedTuple):
+    compressed: bool
+    encoding: str
+    # node section length, including its padding
+    node_size: int
+    # None if it couldn't be read without reading the whole node section
+    data_size: int | None
+
+    @property
+    def size(self) -> int | None:
+        """Size of the whole document"""
+        if self.data_size is None:
+            return None
+        return 8 + self.node_size + 4 + self.data_size
+
+
+def parse_header(header) -> KBinHeader:
+    """The header in the first 8 bytes of `header`, without `data_size`.
+    Raises `KBinException` if it isn't a kbin header"""
+    if len(header) < 8:
+        raise KBinException("Input too short to be a kbin document")
+    sig, compress, encoding_key, encoding_check, nodeLen = _header.unpack_from(header)
+    if sig != SIGNATURE or compress not in (SIG_COMPRESSED, SIG_UNCOMPRESSED):
+        raise KBinException("Input is not a kbin document")
+    if encoding_check != 0xFF ^ encoding_key or encoding_key not in encoding_strings:
+        raise KBinException("Invalid kbin encoding flag")
+    return KBinHeader(
+        compress == SIG_COMPRESSED, encoding_strings[encoding_key], nodeLen, None
+    )
+
+
+def decode_string(
+    data: bytes, encoding: str, convert_illegal_things=False, instrumentation=None
+) -> str:
+    try:
+        return stringcache.decode(data, encoding)
+    except UnicodeDecodeError as e:
+        if encoding == "cp932":
+            if not convert_illegal_things:
+                raise KBinException(
+                    f"Could not decode string. To force utf8 decode {convert_illegal_help}."
+                ) from e
+
+            if instrumentation is not None:
+                instrumentation.record_fallback(data)
+
+            # having to do this kinda sucks, but it's better than just giving up
+            print(
+                "KBinXML: Malformed Shift-JIS string found, attempting UTF-8 decode",
+                file=sys.stderr,
+            )
+            print("KBinXML: Raw string data:", data, file=sys.stderr)
+            return data.decode("utf8")
+        else:
+            # in the unlikely event of malformed data that isn't shift-jis,
+            # fix it later
+            raise
+
+
+class EncodeResult(NamedTuple):
+    """A binary document plus the statistics gathered while encoding it"""
+
+    binary: bytes
+    # used when allocating memory ingame
+    mem_size: int
+    node_count: int
+    # data section memory, as counted by `mem_size`
+    data_size: int
+
+
+def _start_element(writer, tag, attrib, text):
+    """Open the node for an XML element, given its attribute mapping and the
+    text before its first child"""
+    nodeType = attrib.get("__type")
+    if not nodeType:
+        # typeless tags with text become string
+        if text is not None and len(text.strip()) > 0:
+            nodeType = "str"
+        else:
+            nodeType = "void"
+    nodeId = xml_types[nodeType]
+
+    isArray = False
+    count = attrib.get("__count")
+    if count:
+        count = int(count)
+        isArray = True
+
+    data = None
+    if nodeId != NODE_START:
+        fmt = xml_formats[nodeId]
+
+        val = text
+        if nodeId == BINARY:
+            data = bytes.fromhex(val)
+        elif nodeId == STRING:
+            if val is None:  # empty string
+                val = ""
+            data = val
+        else:
+            val = val.split(" ")
+            data = list(map(fmt.get("fromStr", int), val))
+            if count and len(data) / fmt["count"] != count:
+                raise ValueError("Array length does not match __count attribute")
+
+    attrs = {
+        key: value
+        for key, value in attrib.items()
+        if key not in ("__type", "__size", "__count")
+    }
+    writer.start(tag, attrs, nodeId, data, isArray)
+
+
+def _element_to_binary(node, writer):
+    """Write an lxml element and everything under it"""
+    # an explicit stack, so deep documents can't hit the recursion limit
+    Element = get_etree().Element
+    _start_element(writer, node.tag, node.attrib, node.text)
+    stack = [node.iterchildren(tag=Element)]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+            writer.end()
+        else:
+            _start_element(writer, child.tag, child.attrib, child.text)
+            stack.append(child.iterchildren(tag=Element))
+
+
 class KBinXML:
-    def __init__(self, input, convert_illegal_things=False):
+    def __init__(self, input, convert_illegal_things=False, instrumentation=None):
         """If `convert_illegal_things` is true,
         - Any shift-jis string that cannot be decoded as shift-jis will
           try to be decoded as utf-8
         - If a node name is invalid (for example, it starts with a number),
           the name will be prefixed with an underscore
+
+        `instrumentation` is an `Instrumentation` to record into, instead of
+        the global one (if any)
         """
-        self.convert_illegal_things = convert_illegal_things
-        if isinstance(input, etree._Element):
+        self._init_settings(convert_illegal_things, instrumentation)
+        if is_element(input):
             self.xml_doc = input
-        elif isinstance(input, etree._ElementTree):
+            self._element_defaults()
+        elif is_element_tree(input):
             self.xml_doc = input.getroot()
+            self._element_defaults()
         elif KBinXML.is_binary_xml(input):
             self.from_binary(input)
         else:
             self.from_text(input)
 
+    def _init_settings(self, convert_illegal_things, instrumentation):
+        self.convert_illegal_things = convert_illegal_things
+        self.instrumentation = instrumentation
+        self.encode_result = None
+        # the settings and tree `encode_result` is known to be for
+        self._encode_key = None
+
+    @classmethod
+    def _from_tree(
+        cls, xml_doc, convert_illegal_things=False, instrumentation=None
+    ) -> "KBinXML":
+        """Wrap an lxml element without guessing what the input is. `xml_doc`
+        may be None, for a tree that `_tree_builder` builds afterwards"""
+        self = cls.__new__(cls)
+        self._init_settings(convert_illegal_things, instrumentation)
+        self.xml_doc = xml_doc
+        if xml_doc is not None:
+            self._element_defaults()
+        return self
+
     def to_text(self) -> str:
-        # we decode again because I want unicode, dammit
-        return etree.tostring(
-            self.xml_doc, pretty_print=True, encoding=XML_ENCODING, xml_declaration=True
-        ).decode(XML_ENCODING)
+        with phase(get_instrumentation(self.instrumentation), "to_text"):
+            # we decode again because I want unicode, dammit
+            text = get_etree().tostring(
+                self.xml_doc,
+                pretty_print=True,
+                encoding=XML_ENCODING,
+                xml_declaration=True,
+            )
+            return text.decode(XML_ENCODING)
 
     def from_text(self, input):
-        self.xml_doc = etree.parse(BytesIO(input)).getroot()
+        with phase(get_instrumentation(self.instrumentation), "from_text"):
+            self.xml_doc = get_etree().parse(BytesIO(input)).getroot()
+        self._element_defaults()
+
+    def _element_defaults(self):
         self.encoding = XML_ENCODING
         self.compressed = True
         self.dataSize = None
 
+    @classmethod
+    def from_file(
+        cls, path, convert_illegal_things=False, instrumentation=None
+    ) -> "KBinXML":
+        """Load a binary or text file. Binaries are memory-mapped and decoded
+        in place, without reading a copy of the file into memory first"""
+        with open(path, "rb") as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty files can't be mapped
+                return cls(f.read(), convert_illegal_things, instrumentation)
+        with mapped:
+            return cls(mapped, convert_illegal_things, instrumentation)
+
     @staticmethod
     def is_binary_xml(input):
-        if len(input) < 2:
+        # text can never be binary, it would be utf-8 encoded
+        if len(input) < 2 or isinstance(input, str):
             return False
 
-        nodeBuf = ByteBuffer(input)
-        return nodeBuf.get_u8() == SIGNATURE and nodeBuf.get_u8() in (
+        return input[0] == SIGNATURE and input[1] in (
             SIG_COMPRESSED,
             SIG_UNCOMPRESSED,
         )
 
-    @property
-    def _data_mem_size(self):
-        # This is probably better to be done in the parsing/writeout stage...
+    def _cached_encode(self) -> "EncodeResult":
+        # lxml can't say when the tree changes, so compare fingerprints, which
+        # cover everything that affects encoding and cost far less than it
+        from .cache import fingerprint
 
-        data_len = 0
-        for e in self.xml_doc.iter(tag=etree.Element):
-            t = e.attrib.get("__type")
-            if t is None:
-                continue
-
-            count = e.attrib.get("__count", 1)
-            size = e.attrib.get("__size", 1)
-            x = xml_formats[xml_types[t]]
-            if x["count"] > 0:
-                m = x["count"] * calcsize(x["type"]) * count * size
-            elif x["name"] == "bin":
-                m = len(e.text) // 2
-            else:  # string
-                # null terminator space
-                m = len(e.text.encode(self.encoding)) + 1
-
-            if m <= 4:
-                continue
+        key = (self.encoding, self.compressed, fingerprint(self.xml_doc))
+        if key != self._encode_key:
+            self.encode(self.encoding, self.compressed)
+            self._encode_key = key
+        return self.encode_result
 
-            if x["name"] == "bin":
-                data_len += (m + 1) & ~1
-            else:
-                data_len += (m + 3) & ~3
-        return data_len
+    @property
+    def _data_mem_size(self):
+        return self._cached_encode().data_size
 
     @property
     def mem_size(self):
-        """used when allocating memory ingame"""
-
-        data_len = self._data_mem_size
-        node_count = len(list(self.xml_doc.iter(tag=etree.Element)))
-
-        if self.compressed:
-            size = 52 * node_count + data_len + 630
-        else:
-            tags_len = 0
-            for e in self.xml_doc.iter(tag=etree.Element):
-                e_len = max(len(e.tag), 8)
-                e_len = (e_len + 3) & ~3
-                tags_len += e_len
-
-            size = 56 * node_count + data_len + 630 + tags_len
-
-        # debugging
-        # print('nodes:{} ({}) data:{} ({})'.format(node_count,hex(node_count), data_len, hex(data_len)))
-
-        return (size + 8) & ~7
-
-    def data_grab_auto(self):
-        size = self.dataBuf.get_s32()
-        ret = self.dataBuf.get_bytes(size)
-        self.dataBuf.realign_reads()
-        return ret
-
-    def data_append_auto(self, data):
-        self.dataBuf.append_s32(len(data))
-        self.dataBuf.append_bytes(data)
-        self.dataBuf.realign_writes()
-
-    def data_grab_string(self):
-        data = self.data_grab_auto()
-        data = bytes(data[:-1])
-        try:
-            return data.decode(self.encoding)
-        except UnicodeDecodeError as e:
-            if self.encoding == "cp932":
-                if not self.convert_illegal_things:
-                    raise KBinException(
-                        f"Could not decode string. To force utf8 decode {convert_illegal_help}."
-                    ) from e
-
-                # having to do this kinda sucks, but it's better than just giving up
-                print(
-                    "KBinXML: Malformed Shift-JIS string found, attempting UTF-8 decode",
-                    file=sys.stderr,
-                )
-                print("KBinXML: Raw string data:", data, file=sys.stderr)
-                return data.decode("utf8")
-            else:
-                # in the unlikely event of malformed data that isn't shift-jis,
-                # fix it later
-                raise
-
-    def data_append_string(self, string):
-        string = bytes(string.encode(self.encoding) + b"\0")
-        self.data_append_auto(string)
-
-    # has its own separate state and other assorted garbage
-    def data_grab_aligned(self, type, count):
-        if self.dataByteBuf.offset % 4 == 0:
-            self.dataByteBuf.offset = self.dataBuf.offset
-        if self.dataWordBuf.offset % 4 == 0:
-            self.dataWordBuf.offset = self.dataBuf.offset
-        # multiply by count since 2u2 reads from the 16 bit buffer, for example
-        size = calcsize(type) * count
-        if size == 1:
-            ret = self.dataByteBuf.get(type, count)
-        elif size == 2:
-            ret = self.dataWordBuf.get(type, count)
-        else:
-            ret = self.dataBuf.get(type, count)
-            self.dataBuf.realign_reads()
-        trailing = max(self.dataByteBuf.offset, self.dataWordBuf.offset)
-        if self.dataBuf.offset < trailing:
-            self.dataBuf.offset = trailing
-            self.dataBuf.realign_reads()
-        return ret
-
-    def data_append_aligned(self, data, type, count):
-        if self.dataByteBuf.offset % 4 == 0:
-            self.dataByteBuf.offset = self.dataBuf.offset
-        if self.dataWordBuf.offset % 4 == 0:
-            self.dataWordBuf.offset = self.dataBuf.offset
-        # multiply by count since 2u2 reads from the 16 bit buffer, for example
-        size = calcsize(type) * count
-        if size == 1:
-            # make room for our stuff if fresh dword
-            if self.dataByteBuf.offset % 4 == 0:
-                self.dataBuf.append_u32(0)
-            self.dataByteBuf.set(data, self.dataByteBuf.offset, type, count)
-        elif size == 2:
-            if self.dataWordBuf.offset % 4 == 0:
-                self.dataBuf.append_u32(0)
-            self.dataWordBuf.set(data, self.dataWordBuf.offset, type, count)
-        else:
-            self.dataBuf.append(data, type, count)
-            self.dataBuf.realign_writes()
-
-    def append_node_name(self, name):
-        if self.compressed:
-            pack_sixbit(name, self.nodeBuf)
-        else:
-            enc = name.encode(self.encoding)
-            self.nodeBuf.append_u8((len(enc) - 1) | 64)
-            self.nodeBuf.append_bytes(enc)
+        """used when allocating memory ingame. Always for `xml_doc` as it is
+        now: a fingerprint of the tree is kept, and the last `encode` is only
+        reused while it matches"""
+        return self._cached_encode().mem_size
 
     def _add_namespace(self, node, name, value):
         """Add a namespace (xmlns) to an existing node. Returns the new node to
@@ -236,7 +301,7 @@ class KBinXML:
         ns = node.nsmap
         ns[name] = value
         old_node = node
-        node = etree.Element(old_node.tag, nsmap=ns)
+        node = get_etree().Element(old_node.tag, nsmap=ns)
         node[:] = old_node[:]
         parent = old_node.getparent()
         if parent is not None:
@@ -244,246 +309,627 @@ class KBinXML:
             parent.append(node)
         return node
 
-    def _node_to_binary(self, node):
-        nodeType = node.attrib.get("__type")
-        if not nodeType:
-            # typeless tags with text become string
-            if node.text is not None and len(node.text.strip()) > 0:
-                nodeType = "str"
-            else:
-                nodeType = "void"
-        nodeId = xml_types[nodeType]
-
-        isArray = 0
-        count = node.attrib.get("__count")
-        if count:
-            count = int(count)
-            isArray = 64  # bit position for array flag
-
-        self.nodeBuf.append_u8(nodeId | isArray)
-
-        name = node.tag
-        self.append_node_name(name)
-
-        if nodeType != "void":
-            fmt = xml_formats[nodeId]
+    def _set_attribute(self, node, name, value):
+        """Set an attribute read from a binary. Returns the node to continue
+        working with, as namespaces have to recreate it"""
+        # because someone thought it was a good idea to serialise namespaces
+        if name.startswith("xmlns:"):
+            _, name = name.split("xmlns:")
+            node = self._add_namespace(node, name, value)
+        elif ":" in name:
+            prefix, name = name.split(":")
+            # if this fails, the xml is invalid. Open an issue.
+            node.set(get_etree().QName(node.nsmap[prefix], name), value)
+        # this is the case you'll get in 99% of places
+        else:
+            node.attrib[name] = value
+        return node
 
-            val = node.text
-            if fmt["name"] == "bin":
-                data = bytes(bytearray.fromhex(val))
-            elif fmt["name"] == "str":
-                if val is None:  # empty string
-                    val = ""
-                data = bytes(val.encode(self.encoding, "replace") + b"\0")
-            else:
-                val = val.split(" ")
-                data = list(map(fmt.get("fromStr", int), val))
-                if count and len(data) / fmt["count"] != count:
-                    raise ValueError("Array length does not match __count attribute")
-
-            if isArray or fmt["count"] == -1:
-                self.dataBuf.append_u32(len(data) * calcsize(fmt["type"]))
-                self.dataBuf.append(data, fmt["type"], len(data))
-                self.dataBuf.realign_writes()
+    def _sub_element(self, parent, name):
+        etree = get_etree()
+        try:
+            return etree.SubElement(parent, name)
+        except ValueError as e:
+            fixed_name = f"_{name}"
+            if self.convert_illegal_things:
+                # todo: there are other invalid node names. Fix them when you see them.
+                return etree.SubElement(parent, fixed_name)
             else:
-                self.data_append_aligned(data, fmt["type"], fmt["count"])
-
-        # for test consistency and to be more faithful, sort the attrs
-        sorted_attrs = sorted(node.attrib.items(), key=operator.itemgetter(0))
-        for key, value in sorted_attrs:
-            if key not in ["__type", "__size", "__count"]:
-                self.data_append_string(value)
-                self.nodeBuf.append_u8(xml_types["attr"])
-                self.append_node_name(key)
-
-        for child in node.iterchildren(tag=etree.Element):
-            self._node_to_binary(child)
+                raise KBinException(
+                    f'Could not create node with name "{name}". To rename it to "{fixed_name}", {convert_illegal_help}.'
+                ) from e
 
-        # always has the isArray bit set
-        self.nodeBuf.append_u8(xml_types["nodeEnd"] | 64)
+    def _node_to_binary(self, node, writer):
+        _element_to_binary(node, writer)
 
-    def to_binary(self, encoding=BIN_ENCODING, compressed=True):
+    def _encode(self, encoding, compressed, finish):
         self.encoding = encoding
         self.compressed = compressed
 
-        header = ByteBuffer()
-        header.append_u8(SIGNATURE)
-        if self.compressed:
-            header.append_u8(SIG_COMPRESSED)
-        else:
-            header.append_u8(SIG_UNCOMPRESSED)
-        header.append_u8(encoding_vals[self.encoding])
-        # Python's ints are big, so can't just bitwise invert
-        header.append_u8(0xFF ^ encoding_vals[self.encoding])
-        self.nodeBuf = ByteBuffer()
-        self.dataBuf = ByteBuffer()
-        self.dataByteBuf = ByteBuffer(self.dataBuf.data)
-        self.dataWordBuf = ByteBuffer(self.dataBuf.data)
-
-        self._node_to_binary(self.xml_doc)
+        instrumentation = get_instrumentation(self.instrumentation)
+        with phase(instrumentation, "to_binary"):
+            writer = KBinWriter(encoding, compressed, instrumentation)
+            self._node_to_binary(self.xml_doc, writer)
+            result = finish(writer)
+        self.dataSize = writer.dataSize
+        return writer, result
+
+    def encode(self, encoding=BIN_ENCODING, compressed=True) -> "EncodeResult":
+        """Like `to_binary`, but also returns the statistics gathered while
+        encoding. The result is cached as `encode_result`"""
+        writer, binary = self._encode(encoding, compressed, KBinWriter.finish)
+        self.encode_result = EncodeResult(
+            binary, writer.mem_size, writer.nodeCount, writer.dataMemSize
+        )
+        # the tree isn't fingerprinted here, to keep encoding fast
+        self._encode_key = None
+        return self.encode_result
 
-        # always has the isArray bit set
-        self.nodeBuf.append_u8(xml_types["endSection"] | 64)
-        self.nodeBuf.realign_writes()
-        header.append_u32(len(self.nodeBuf))
-        self.dataSize = len(self.dataBuf)
-        self.nodeBuf.append_u32(self.dataSize)
-        return bytes(header.data + self.nodeBuf.data + self.dataBuf.data)
+    def to_binary(self, encoding=BIN_ENCODING, compressed=True):
+        return self.encode(encoding, compressed).binary
+
+    def to_binary_into(
+        self, buffer, offset=0, encoding=BIN_ENCODING, compressed=True
+    ) -> int:
+        """Encode straight into `buffer` (a bytearray or writable memoryview)
+        at `offset`, with no intermediate copy of the whole binary. Returns
+        the number of bytes written. Raises ValueError, before writing
+        anything, if it doesn't fit"""
+        _, size = self._encode(
+            encoding, compressed, lambda writer: writer.finish_into(buffer, offset)
+        )
+        return size
 
     def from_binary(self, input):
-        self.xml_doc = etree.Element("root")
-        node = self.xml_doc
+        instrumentation = get_instrumentation(self.instrumentation)
+        with phase(instrumentation, "from_binary"):
+            self._from_binary(input, instrumentation)
 
-        self.nodeBuf = ByteBuffer(input)
-        assert self.nodeBuf.get_u8() == SIGNATURE
+    def _from_binary(self, input, instrumentation):
+        reader = KBinReader(
+            input, self.convert_illegal_things, instrumentation=instrumentation
+        )
+        try:
+            self._reader_defaults(reader)
+            builder = self._tree_builder()
+            next(builder)
+            send = builder.send
+            for event in reader.events():
+                send(event)
+        finally:
+            # or closing an mmap we were given hides the actual error
+            reader.close()
+        builder.close()
+
+    def _reader_defaults(self, reader):
+        self.compressed = reader.compressed
+        self.encoding = reader.encoding
+        self.dataSize = reader.dataSize
+
+    def _tree_builder(self):
+        """Coroutine building `xml_doc` from the `KBinReader` events sent to
+        it. Prime it with `next`, and `close` it once the events run out"""
+        root = get_etree().Element("root")
+        node = root
+        try:
+            while True:
+                event = yield
+                kind = event[0]
+                if kind == "start":
+                    _, name, nodeType, isArray = event
+                    node = self._sub_element(node, name)
+                    if nodeType != NODE_START:
+                        nodeFormat = xml_formats[nodeType]
+                        node.attrib["__type"] = nodeFormat["name"]
+                elif kind == "value":
+                    data = event[1]
+                    if nodeType == BINARY:
+                        node.attrib["__size"] = str(len(data))
+                        string = data.hex()
+                    elif nodeType == STRING:
+                        string = data
+                    else:
+                        if nodeFormat["count"] == 1 and not isArray:
+                            data = (data,)
+                        elif isArray:
+                            count = len(data) // nodeFormat["count"]
+                            node.attrib["__count"] = str(count)
+                        string = format_values(nodeFormat, data)
+
+                    # some strings have extra NUL bytes, compatible behaviour is
+                    # to strip them
+                    node.text = string.strip("\0")
+                elif kind == "attr":
+                    node = self._set_attribute(node, event[1], event[2])
+                else:  # end
+                    node = node.getparent()
+        except GeneratorExit:
+            # because we need the 'real' root. There is none if this was
+            # abandoned before the first node
+            if len(root):
+                self.xml_doc = root[0]
+
+
+class KBinReader:
+    """Parses the header of a binary document on construction, then walks
+    its node stream as a series of events (see `iterparse`).
 
-        compress = self.nodeBuf.get_u8()
-        assert compress in (SIG_COMPRESSED, SIG_UNCOMPRESSED)
-        self.compressed = compress == SIG_COMPRESSED
+    `array_type` picks how array values are returned: None for tuples,
+    "array" for `array.array`, or "numpy" for read-only NumPy arrays that
+    share the input buffer. `instrumentation` is as for `KBinXML`."""
 
-        encoding_key = self.nodeBuf.get_u8()
-        assert self.nodeBuf.get_u8() == 0xFF ^ encoding_key
-        self.encoding = encoding_strings[encoding_key]
+    def __init__(
+        self, input, convert_illegal_things=False, array_type=None, instrumentation=None
+    ):
+        check_array_type(array_type)
+        self.convert_illegal_things = convert_illegal_things
+        self.array_type = array_type
+        self.instrumentation = instrumentation = get_instrumentation(instrumentation)
+        self.nodeBuf = ByteBuffer(input)
+        self.dataBuf = None
+        try:
+            header = parse_header(self.nodeBuf.data)
+            self.compressed = header.compressed
+            self.encoding = header.encoding
+
+            nodeEnd = header.node_size + 8
+            if nodeEnd + 4 > len(self.nodeBuf):
+                raise KBinException("Node section runs past the end of the input")
+            self.nodeBuf.offset = 8
+            self.nodeBuf.end = nodeEnd
+
+            self.dataBuf = ByteBuffer(self.nodeBuf.data, nodeEnd)
+            self.dataSize = self.dataBuf.get_u32()
+            # where the 1 and 2 byte values packed into shared dwords are
+            self.layout = DataLayout(self.dataBuf.offset)
+        except Exception:
+            # let go of the input, or closing an mmap hides this error
+            self.close()
+            raise
+
+        if instrumentation is not None:
+            # instance attributes shadow the methods, so timing costs nothing
+            # when instrumentation is off
+            timed = instrumentation.timed
+            self.read_node_name = timed("node_names", self.read_node_name)
+            self.data_grab_auto = timed("data_reads", self.data_grab_auto)
+            self.data_grab_aligned = timed("data_reads", self.data_grab_aligned)
+            self.data_grab_array = timed("data_reads", self.data_grab_array)
+            self.data_grab_string = timed("strings", self.data_grab_string)
+            self.data_grab_node_string = timed("strings", self.data_grab_node_string)
+
+    # for input that is still arriving: a generator function given the size
+    # of the next value (None if length prefixed), yielding None until it's
+    # all there. See `stream._FeedReader`
+    _wait_data = None
+
+    def close(self):
+        """Release the input buffer. Only needed to close an mmap afterwards"""
+        for buf in (self.nodeBuf, self.dataBuf):
+            if buf is not None:
+                buf.release()
 
-        nodeEnd = self.nodeBuf.get_u32() + 8
-        self.nodeBuf.end = nodeEnd
+    def data_grab_auto(self):
+        size = self.dataBuf.get_s32()
+        ret = self.dataBuf.get_bytes(size)
+        self.dataBuf.realign_reads()
+        return ret
 
-        self.dataBuf = ByteBuffer(input, nodeEnd)
-        self.dataSize = self.dataBuf.get_u32()
-        # This is all no fun
-        self.dataByteBuf = ByteBuffer(input, nodeEnd)
-        self.dataWordBuf = ByteBuffer(input, nodeEnd)
+    def data_grab_string(self):
+        data = self.data_grab_auto()
+        return decode_string(
+            bytes(data[:-1]),
+            self.encoding,
+            self.convert_illegal_things,
+            self.instrumentation,
+        )
 
-        nodesLeft = True
-        while nodesLeft and self.nodeBuf.hasData():
-            while self.nodeBuf.peek_u8() == 0:
-                debug_print("Skipping 0 node ID")
-                self.nodeBuf.get_u8()
+    def data_grab_node_string(self):
+        # node values are decoded strictly, unlike attributes
+        data = bytes(self.data_grab_auto()[:-1])
+        return stringcache.decode(data, self.encoding).strip("\0")
+
+    def data_grab_array(self, nodeFormat):
+        dataBuf = self.dataBuf
+        varCount = nodeFormat["count"]
+        arrayCount = dataBuf.get_u32() // (nodeFormat["size"] * varCount)
+        count = arrayCount * varCount
+        data = unpack_array(
+            dataBuf.data, dataBuf.offset, nodeFormat["type"], count, self.array_type
+        )
+        dataBuf.offset += count * nodeFormat["size"]
+        dataBuf.realign_reads()
+        return data
 
-            nodeType = self.nodeBuf.get_u8()
-            isArray = nodeType & 64
+    def data_grab_aligned(self, type, count):
+        # multiply by count since 2u2 reads from the 16 bit slots, for example
+        codec = get_struct(type, count)
+        layout = self.layout
+        layout.offset = self.dataBuf.offset
+        offset = layout.fixed(codec.size)
+        self.dataBuf.offset = layout.offset
+        return codec.unpack_from(self.dataBuf.data, offset)
+
+    def read_node_name(self):
+        if self.compressed:
+            return unpack_sixbit(self.nodeBuf)
+        length = (self.nodeBuf.get_u8() & ~64) + 1
+        name = self.nodeBuf.get_bytes(length)
+        return sixbit.decode_name(bytes(name), self.encoding)
+
+    def events(self):
+        """Yields, in document order:
+        - `("start", name, type_id, is_array)` for each node
+        - `("value", value)` straight after the start of a typed node
+        - `("attr", name, value)` for each attribute of the open node
+        - `("end", name)` when a node closes
+
+        Values are typed: bytes for `bin`, str for `str`, a number for single
+        values and a flat tuple for vectors and arrays (see `array_type`).
+
+        Before each value, anything yielded by `_wait_data` is passed on.
+        """
+        nodeBuf = self.nodeBuf
+        instrumentation = self.instrumentation
+        wait = self._wait_data
+        names = []
+        while nodeBuf.hasData():
+            nodeType = nodeBuf.get_u8()
+            if nodeType == 0:
+                continue
+            isArray = bool(nodeType & 64)
             nodeType &= ~64
 
-            nodeFormat = xml_formats.get(nodeType, {"name": "Unknown"})
-            debug_print("Node type is {} ({})".format(nodeFormat["name"], nodeType))
+            if nodeType == NODE_END:
+                if names:
+                    yield ("end", names.pop())
+                continue
+            elif nodeType == END_SECTION:
+                break
 
             # node or attribute name
-            name = ""
-            if nodeType != xml_types["nodeEnd"] and nodeType != xml_types["endSection"]:
-                if self.compressed:
-                    name = unpack_sixbit(self.nodeBuf)
-                else:
-                    length = (self.nodeBuf.get_u8() & ~64) + 1
-                    name = self.nodeBuf.get_bytes(length)
-                    name = bytes(name).decode(self.encoding)
-                debug_print(name)
-
-            skip = True
-
-            if nodeType == xml_types["attr"]:
-                value = self.data_grab_string()
-                # because someone thought it was a good idea to serialise namespaces
-                if name.startswith("xmlns:"):
-                    _, name = name.split("xmlns:")
-                    node = self._add_namespace(node, name, value)
-                elif ":" in name:
-                    prefix, name = name.split(":")
-                    # if this fails, the xml is invalid. Open an issue.
-                    node.set(etree.QName(node.nsmap[prefix], name), value)
-                # this is the case you'll get in 99% of places
-                else:
-                    node.attrib[name] = value
-            elif nodeType == xml_types["nodeEnd"]:
-                if node.getparent() is not None:
-                    node = node.getparent()
-            elif nodeType == xml_types["endSection"]:
-                nodesLeft = False
+            name = self.read_node_name()
+
+            if nodeType == ATTR:
+                if wait is not None:
+                    yield from wait(None)
+                yield ("attr", name, self.data_grab_string())
+                continue
             elif nodeType not in xml_formats:
                 raise NotImplementedError("Implement node {}".format(nodeType))
-            else:  # inner value to process
-                skip = False
 
-            if skip:
+            if instrumentation is not None:
+                instrumentation.record_node(nodeType)
+            names.append(name)
+            yield ("start", name, nodeType, isArray)
+            if nodeType == NODE_START:
                 continue
 
-            try:
-                child = etree.SubElement(node, name)
-            except ValueError as e:
-                fixed_name = f"_{name}"
-                if self.convert_illegal_things:
-                    # todo: there are other invalid node names. Fix them when you see them.
-                    child = etree.SubElement(node, fixed_name)
+            nodeFormat = xml_formats[nodeType]
+            if wait is not None:
+                if isArray or nodeFormat["count"] == -1:
+                    yield from wait(None)
                 else:
-                    raise KBinException(
-                        f'Could not create node with name "{name}". To rename it to "{fixed_name}", {convert_illegal_help}.'
-                    ) from e
-            node = child
+                    yield from wait(nodeFormat["struct"].size)
+            if nodeType == BINARY:
+                yield ("value", bytes(self.data_grab_auto()))
+            elif nodeType == STRING:
+                yield ("value", self.data_grab_node_string())
+            elif isArray:
+                yield ("value", self.data_grab_array(nodeFormat))
+            else:
+                data = self.data_grab_aligned(nodeFormat["type"], nodeFormat["count"])
+                yield ("value", data[0] if nodeFormat["count"] == 1 else data)
 
-            if nodeType == xml_types["nodeStart"]:
-                continue
+        if instrumentation is not None:
+            nodeEnd = nodeBuf.end
+            instrumentation.record_bytes("read", "header", 8)
+            instrumentation.record_bytes("read", "node", nodeEnd - 8)
+            instrumentation.record_bytes("read", "data", self.dataBuf.offset - nodeEnd)
 
-            node.attrib["__type"] = nodeFormat["name"]
 
-            varCount = nodeFormat["count"]
-            arrayCount = 1
-            if varCount == -1:  # the 2 cannot be combined
-                varCount = self.dataBuf.get_u32()
-                isArray = True
-            elif isArray:
-                arrayCount = self.dataBuf.get_u32() // (
-                    calcsize(nodeFormat["type"] * varCount)
+def iterparse(input, convert_illegal_things=False, array_type=None):
+    """Walk a binary document without building a tree, like
+    `lxml.etree.iterparse`. See `KBinReader.events` for the events yielded"""
+    return KBinReader(input, convert_illegal_things, array_type).events()
+
+
+class KBinWriter:
+    """Builds a binary document directly from `start`/`value`/`end` calls,
+    without an intermediate tree. Values are native Python values, as
+    produced by `iterparse`: bytes for `bin`, str for `str`, a number or a
+    flat sequence of numbers for everything else. `array.array` and NumPy
+    arrays are packed in bulk. `instrumentation` is as for `KBinXML`.
+
+    `buffers` is an optional pair of bytearrays to write the node and data
+    sections into, which may be reused afterwards (see `KBinCodec`)."""
+
+    def __init__(
+        self, encoding=BIN_ENCODING, compressed=True, instrumentation=None, buffers=None
+    ):
+        self.encoding = encoding
+        self.compressed = compressed
+        self.depth = 0
+        self.dataSize = None
+        # packed by _finalise, which only ever runs once
+        self.header = None
+        # for mem_size, gathered as we go
+        self.nodeCount = 0
+        self.tagsLen = 0
+        self.dataMemSize = 0
+
+        nodeData, data = (None, None) if buffers is None else buffers
+        # reused buffers hold old documents, write over them
+        self.nodeBuf = ByteBuffer(nodeData, end=0)
+        self.dataBuf = ByteBuffer(data, end=0)
+        self.layout = DataLayout()
+
+        self.instrumentation = instrumentation = get_instrumentation(instrumentation)
+        if instrumentation is not None:
+            timed = instrumentation.timed
+            self.append_node_name = timed("node_names", self.append_node_name)
+            self.data_append_auto = timed("data_writes", self.data_append_auto)
+            self.data_append_aligned = timed("data_writes", self.data_append_aligned)
+            self.data_append_string = timed("strings", self.data_append_string)
+
+    def data_append_auto(self, data):
+        self.dataBuf.append_s32(len(data))
+        self.dataBuf.append_bytes(data)
+        self.dataBuf.realign_writes()
+
+    def data_append_string(self, string):
+        string = stringcache.encode(string, self.encoding) + b"\0"
+        self.data_append_auto(string)
+
+    def data_append_aligned(self, data, type, count):
+        # multiply by count since 2u2 goes in the 16 bit slots, for example
+        codec = get_struct(type, count)
+        dataBuf = self.dataBuf
+        layout = self.layout
+        layout.offset = dataBuf.offset
+        offset = layout.fixed(codec.size)
+        # zeroed, so padding and unused slots in a shared dword are too
+        dataBuf.append_bytes(bytes(layout.offset - dataBuf.offset))
+        try:
+            codec.pack_into(dataBuf.data, offset, *data)
+        except TypeError:
+            codec.pack_into(dataBuf.data, offset, data)
+
+    def append_node_name(self, name):
+        if self.compressed:
+            pack_sixbit(name, self.nodeBuf)
+        else:
+            enc = sixbit.encode_name(name, self.encoding)
+            self.nodeBuf.append_u8((len(enc) - 1) | 64)
+            self.nodeBuf.append_bytes(enc)
+
+    def start(self, name, attrs=None, type=NODE_START, value=None, is_array=None):
+        """Open a node. `type` is a type name or id; anything but void also
+        needs a `value`. `is_array` is guessed from the value if not given:
+        a sequence of single values, or one that isn't exactly one vector."""
+        nodeId = xml_types[type] if isinstance(type, str) else type
+        fmt = xml_formats[nodeId]
+
+        isArray = bool(is_array)
+        if nodeId != NODE_START and fmt["count"] != -1:
+            if isinstance(value, (int, float)):
+                value = (value,)
+            elif is_array is None:
+                # any sequence of single values, or anything but one vector
+                isArray = fmt["count"] == 1 or len(value) != fmt["count"]
+            if len(value) % fmt["count"] or (
+                not isArray and len(value) != fmt["count"]
+            ):
+                multiple = "a multiple of " if isArray else ""
+                raise ValueError(
+                    f"{fmt['name']} node {name} needs {multiple}"
+                    f"{fmt['count']} values, got {len(value)}"
                 )
-                node.attrib["__count"] = str(arrayCount)
-            totalCount = arrayCount * varCount
 
-            if isArray:
-                data = self.dataBuf.get(nodeFormat["type"], totalCount)
-                self.dataBuf.realign_reads()
+        self.nodeBuf.append_u8(nodeId | (64 if isArray else 0))
+        self.append_node_name(name)
+        self.nodeCount += 1
+        if self.instrumentation is not None:
+            self.instrumentation.record_node(nodeId)
+        if not self.compressed:
+            self.tagsLen += (max(len(name), 8) + 3) & ~3
+
+        if nodeId == BINARY:
+            data = bytes(value)
+            self.data_append_auto(data)
+            if len(data) > 4:
+                self.dataMemSize += (len(data) + 1) & ~1
+        elif nodeId != NODE_START:
+            if nodeId == STRING:
+                data = stringcache.encode(value, self.encoding, "replace") + b"\0"
+                self.data_append_auto(data)
+                size = len(data)
+            elif isArray:
+                self.data_append_auto(pack_array(fmt["type"], value))
+                size = len(value) * fmt["size"]
             else:
-                data = self.data_grab_aligned(nodeFormat["type"], totalCount)
+                self.data_append_aligned(value, fmt["type"], fmt["count"])
+                size = fmt["struct"].size
+            if size > 4:
+                self.dataMemSize += (size + 3) & ~3
+
+        if attrs:
+            # for test consistency and to be more faithful, sort the attrs
+            for key, val in sorted(attrs.items(), key=operator.itemgetter(0)):
+                self.data_append_string(val)
+                self.nodeBuf.append_u8(ATTR)
+                self.append_node_name(key)
 
-            if nodeType == xml_types["binary"]:
-                node.attrib["__size"] = str(totalCount)
-                string = "".join(("{0:02x}".format(x) for x in data))
-            elif nodeType == xml_types["string"]:
-                string = bytes(data[:-1]).decode(self.encoding)
-            else:
-                string = " ".join(map(nodeFormat.get("toStr", str), data))
+        self.depth += 1
 
-            # some strings have extra NUL bytes, compatible behaviour is to strip
-            node.text = string.strip("\0")
+    def end(self):
+        """Close the most recently opened node"""
+        if not self.depth:
+            raise KBinException("end() called with no open node")
+        self.depth -= 1
+        # always has the isArray bit set
+        self.nodeBuf.append_u8(NODE_END | 64)
 
-        # because we need the 'real' root
-        self.xml_doc = self.xml_doc[0]
+    @property
+    def mem_size(self):
+        """used when allocating memory ingame"""
+        if self.compressed:
+            size = 52 * self.nodeCount + self.dataMemSize + 630
+        else:
+            size = 56 * self.nodeCount + self.dataMemSize + 630 + self.tagsLen
+        return (size + 8) & ~7
+
+    def value(self, name, type, value, attrs=None, is_array=None):
+        """Write a complete node holding a value, ie `start` plus `end`"""
+        self.start(name, attrs, type, value, is_array)
+        self.end()
+
+    @property
+    def size(self) -> int:
+        """Exact size of the finished binary, known before `finish`"""
+        if self.header is not None:
+            return len(self.header) + self.nodeBuf.offset + self.dataBuf.offset
+        # end marker, padding to a dword and the data size
+        nodeSize = (self.nodeBuf.offset + 4) & ~3
+        return _header.size + nodeSize + 4 + self.dataBuf.offset
+
+    def _finalise(self):
+        """Close off the node section and pack the header, once"""
+        if self.header is not None:
+            return
+        if self.depth:
+            raise KBinException(f"{self.depth} nodes were never closed")
+
+        encoding_key = encoding_vals[self.encoding]
+        # always has the isArray bit set
+        self.nodeBuf.append_u8(END_SECTION | 64)
+        self.nodeBuf.realign_writes()
+        self.dataSize = self.dataBuf.offset
+        if self.instrumentation is not None:
+            self.instrumentation.record_bytes("written", "header", 8)
+            self.instrumentation.record_bytes("written", "node", self.nodeBuf.offset)
+            self.instrumentation.record_bytes("written", "data", self.dataSize + 4)
+        self.header = _header.pack(
+            SIGNATURE,
+            SIG_COMPRESSED if self.compressed else SIG_UNCOMPRESSED,
+            encoding_key,
+            # Python's ints are big, so can't just bitwise invert
+            0xFF ^ encoding_key,
+            self.nodeBuf.offset,
+        )
+        self.nodeBuf.append_u32(self.dataSize)
+
+    def finish(self, file=None) -> bytes | None:
+        """Finalise the document. Returns the binary, or writes it to `file`
+        to avoid joining the sections into one more copy"""
+        self._finalise()
+        header = self.header
+        # views of just the written part, the buffers may be bigger
+        with self.nodeBuf.getbuffer() as nodes, self.dataBuf.getbuffer() as data:
+            if file is None:
+                return b"".join((header, nodes, data))
+            file.write(header)
+            file.write(nodes)
+            file.write(data)
+        return None
+
+    def finish_into(self, buffer, offset=0) -> int:
+        """Finalise the document, writing it into `buffer` (a bytearray,
+        memoryview or anything else writable) at `offset`. Returns the
+        number of bytes written, which is `size`"""
+        self._finalise()
+        header = self.header
+        size = self.size
+        with memoryview(buffer) as view, view.cast("B") as dest:
+            if offset < 0 or offset + size > len(dest):
+                raise ValueError(
+                    f"Buffer too small: need {size} bytes at offset {offset}, "
+                    f"it is {len(dest)} bytes long"
+                )
+            with self.nodeBuf.getbuffer() as nodes, self.dataBuf.getbuffer() as data:
+                nodeStart = offset + len(header)
+                dataStart = nodeStart + len(nodes)
+                dest[offset:nodeStart] = header
+                dest[nodeStart:dataStart] = nodes
+                dest[dataStart : dataStart + len(data)] = data
+        return size
 
 
 convert_illegal_help = "set convert_illegal_things=True in the KBinXML constructor"
 
 
+def __getattr__(name):
+    # `etree` used to be imported here, keep it working without importing
+    # lxml up front
+    if name == "etree":
+        return get_etree()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def main():
     # interestingly, this doesn't work if added inside the
     # `if __name__ == "__main__"` branch
     global convert_illegal_help
     convert_illegal_help = "add the --convert-illegal flag"
 
+    # only here, so importing the library doesn't pay for it
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog="kbinxml", description="Convert kbin to xml, or xml to kbin"
     )
-    parser.add_argument("filename", metavar="file.[xml/bin]")
+    parser.add_argument(
+        "filename",
+        metavar="file.[xml/bin]",
+        nargs="+",
+        help="file to convert to stdout. With --output-dir or --in-place, any "
+        "number of files, directories or globs",
+    )
     parser.add_argument("--convert-illegal", action="store_true")
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument(
+        "-o", "--output-dir", help="write conversions into this directory tree"
+    )
+    batch.add_argument(
+        "--in-place",
+        action="store_true",
+        help="overwrite each file with its conversion",
+    )
+    batch.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="worker processes to use (default: one per CPU)",
+    )
 
     args = parser.parse_args()
 
+    if args.output_dir is not None or args.in_place:
+        if args.output_dir is not None and args.in_place:
+            parser.error("--output-dir and --in-place are mutually exclusive")
+        from .batch import run_batch
+
+        sys.exit(
+            run_batch(args.filename, args.output_dir, args.jobs, args.convert_illegal)
+        )
+    if len(args.filename) > 1:
+        parser.error("converting multiple files needs --output-dir or --in-place")
+    args.filename = args.filename[0]
+
     with open(args.filename, "rb") as f:
         input = f.read()
 
-    xml = KBinXML(input, convert_illegal_things=args.convert_illegal)
     stdout = getattr(sys.stdout, "buffer", sys.stdout)
     try:
         if KBinXML.is_binary_xml(input):
-            stdout.write(xml.to_text().encode("utf-8"))
+            from .emitter import write_text
+
+            write_text(input, stdout, args.convert_illegal)
         else:
-            stdout.write(xml.to_binary())
+            from .encoder import write_binary
+
+            write_binary(input, stdout)
     except BrokenPipeError:
         # allows kbinxml to be piped to `head` or similar
         sys.exit(141)
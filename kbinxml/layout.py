@@ -0,0 +1,52 @@
+"""Where values go in the data section.
+
+Length prefixed values (strings, binary, arrays and attributes) and
+values of 4 bytes or more are placed one after the other, each padded to
+a dword. Values of 1 or 2 bytes are packed together into shared dwords
+instead: a dword taken for them is filled by the following values of the
+same size, even when other values were placed in between.
+"""
+
+
+class DataLayout:
+    """Assigns data section offsets to values as they come, by the same
+    rules `KBinWriter` writes them. `offset` is the end of the section so
+    far. It can be moved forward by whoever is following along, eg a
+    reader that skipped a length prefixed value itself."""
+
+    __slots__ = ("offset", "byteOffset", "wordOffset")
+
+    def __init__(self, start=0):
+        self.offset = start
+        # the partially filled dwords that 1 and 2 byte values go in
+        self.byteOffset = start
+        self.wordOffset = start
+
+    def fixed(self, size: int) -> int:
+        """Place a single fixed size value (not an array) of `size` bytes"""
+        offset = self.offset
+        if self.byteOffset % 4 == 0:
+            self.byteOffset = offset
+        if self.wordOffset % 4 == 0:
+            self.wordOffset = offset
+        if size == 1:
+            ret = self.byteOffset
+            self.byteOffset += 1
+        elif size == 2:
+            ret = self.wordOffset
+            self.wordOffset += 2
+        else:
+            ret = offset
+            offset = (offset + size + 3) & ~3
+        trailing = max(self.byteOffset, self.wordOffset)
+        if offset < trailing:
+            offset = (trailing + 3) & ~3
+        self.offset = offset
+        return ret
+
+    def auto(self, length: int) -> int:
+        """Place a value of `length` bytes with its u32 length prefix. The
+        returned offset is that of the prefix"""
+        ret = self.offset
+        self.offset += (length + 4 + 3) & ~3
+        return ret
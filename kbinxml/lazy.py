@@ -0,0 +1,310 @@
+import mmap
+
+from .arrays import check_array_type, unpack_array
+from .format_ids import xml_formats
+from .kbinxml import (
+    ATTR,
+    BINARY,
+    END_SECTION,
+    NODE_END,
+    NODE_START,
+    STRING,
+    KBinException,
+    _u32,
+    decode_string,
+    parse_header,
+)
+from .layout import DataLayout
+from .node import KBinNode
+from . import sixbit, stringcache
+from .sixbit import decode_sixbit
+
+
+class KBinDocument:
+    """A kbin document that is indexed, not decoded.
+
+    Construction makes a single pass over the node section, recording each
+    node's name, type and the offset of its value in the data section. The
+    data section offsets come from a `DataLayout`, like the reader's, so
+    values can be decoded on demand in any order. `input` can be any
+    buffer, including an `mmap`. `array_type` is as for `KBinReader`.
+    """
+
+    def __init__(self, input, convert_illegal_things=False, array_type=None):
+        check_array_type(array_type)
+        self.data = input
+        self.convert_illegal_things = convert_illegal_things
+        self.array_type = array_type
+        self._mmap = None
+
+        header = parse_header(input)
+        self.compressed = header.compressed
+        self.encoding = header.encoding
+
+        self._nodeEnd = nodeEnd = header.node_size + 8
+        if nodeEnd + 4 > len(input):
+            raise KBinException("Node section runs past the end of the input")
+        (self.dataSize,) = _u32.unpack_from(input, nodeEnd)
+
+        # one entry per node, parallel lists keep the index compact
+        self._names: list[str] = []
+        self._types: list[int] = []
+        self._arrays: list[bool] = []
+        self._offsets: list[int] = []
+        self._children: list[list[int]] = []
+        self._attrs: list[list[tuple[str, int]]] = []
+        self._index(nodeEnd)
+
+    @classmethod
+    def from_file(
+        cls, path, convert_illegal_things=False, array_type=None
+    ) -> "KBinDocument":
+        """Memory-map `path` and index it. Call `close` (or use the document
+        as a context manager) to release the mapping"""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            doc = cls(mapped, convert_illegal_things, array_type)
+        except Exception:
+            mapped.close()
+            raise
+        doc._mmap = mapped
+        return doc
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read_name(self, offset):
+        data = self.data
+        if self.compressed:
+            return decode_sixbit(data, offset)
+        length = (data[offset] & ~64) + 1
+        offset += 1
+        name = sixbit.decode_name(bytes(data[offset : offset + length]), self.encoding)
+        return name, offset + length
+
+    def _index(self, nodeEnd):
+        data = self.data
+        nodeOff = 8
+        layout = DataLayout(nodeEnd + 4)
+        stack = []
+
+        while nodeOff < nodeEnd:
+            nodeType = data[nodeOff]
+            nodeOff += 1
+            if nodeType == 0:
+                continue
+            isArray = bool(nodeType & 64)
+            nodeType &= ~64
+
+            if nodeType == NODE_END:
+                if stack:
+                    stack.pop()
+                continue
+            elif nodeType == END_SECTION:
+                break
+
+            name, nodeOff = self._read_name(nodeOff)
+            if nodeType == ATTR:
+                if not stack:
+                    raise KBinException(f"Attribute {name} has no parent node")
+                offset = layout.auto(_u32.unpack_from(data, layout.offset)[0])
+                self._attrs[stack[-1]].append((name, offset))
+                continue
+            elif nodeType not in xml_formats:
+                raise NotImplementedError("Implement node {}".format(nodeType))
+
+            offset = -1
+            if nodeType != NODE_START:
+                fmt = xml_formats[nodeType]
+                if isArray or fmt["count"] == -1:
+                    offset = layout.auto(_u32.unpack_from(data, layout.offset)[0])
+                else:
+                    offset = layout.fixed(fmt["struct"].size)
+
+            index = len(self._names)
+            self._names.append(name)
+            self._types.append(nodeType)
+            self._arrays.append(isArray)
+            self._offsets.append(offset)
+            self._children.append([])
+            self._attrs.append([])
+            if stack:
+                self._children[stack[-1]].append(index)
+            elif index:
+                raise KBinException("kbin document has more than one root node")
+            stack.append(index)
+
+        if not self._names:
+            raise KBinException("kbin document has no nodes")
+
+    def __len__(self):
+        return len(self._names)
+
+    @property
+    def root(self) -> "LazyNode":
+        return LazyNode(self, 0)
+
+    def find(self, path: str) -> "LazyNode | None":
+        """Find a node by `/` separated path, starting with the root's name,
+        eg `call/game/player/name`"""
+        root, _, rest = path.partition("/")
+        if root != self._names[0]:
+            return None
+        return self.root.find(rest) if rest else self.root
+
+    def findall(self, path: str) -> list["LazyNode"]:
+        root, _, rest = path.partition("/")
+        if root != self._names[0]:
+            return []
+        return self.root.findall(rest) if rest else [self.root]
+
+    def value(self, path: str, default=None):
+        """Shortcut for `find(path).value`"""
+        node = self.find(path)
+        return default if node is None else node.value
+
+    def _grab_auto(self, offset) -> bytes:
+        (size,) = _u32.unpack_from(self.data, offset)
+        return bytes(self.data[offset + 4 : offset + 4 + size])
+
+    def _value(self, index):
+        nodeType = self._types[index]
+        if nodeType == NODE_START:
+            return None
+        offset = self._offsets[index]
+        if nodeType == BINARY:
+            return self._grab_auto(offset)
+        elif nodeType == STRING:
+            data = self._grab_auto(offset)[:-1]
+            return stringcache.decode(data, self.encoding).strip("\0")
+
+        fmt = xml_formats[nodeType]
+        if self._arrays[index]:
+            (size,) = _u32.unpack_from(self.data, offset)
+            count = size // (fmt["size"] * fmt["count"]) * fmt["count"]
+            return unpack_array(
+                self.data, offset + 4, fmt["type"], count, self.array_type
+            )
+        value = fmt["struct"].unpack_from(self.data, offset)
+        return value[0] if fmt["count"] == 1 else value
+
+    def _node(self, index) -> KBinNode:
+        """A decoded node, without its children"""
+        return KBinNode(
+            self._names[index],
+            self._types[index],
+            self._value(index),
+            self._attr_dict(index),
+            None,
+            self._arrays[index],
+        )
+
+    def _attr_dict(self, index):
+        return {
+            name: decode_string(
+                self._grab_auto(offset)[:-1], self.encoding, self.convert_illegal_things
+            )
+            for name, offset in self._attrs[index]
+        }
+
+
+class LazyNode:
+    """A view of one node in a `KBinDocument`. Nothing is decoded until
+    `value` or `attrs` is accessed"""
+
+    __slots__ = ("doc", "index")
+
+    def __init__(self, doc: KBinDocument, index: int):
+        self.doc = doc
+        self.index = index
+
+    def __repr__(self):
+        return f"<LazyNode {self.name} ({self.type_name}) @ {self.offset:#x}>"
+
+    @property
+    def name(self) -> str:
+        return self.doc._names[self.index]
+
+    @property
+    def type(self) -> int:
+        return self.doc._types[self.index]
+
+    @property
+    def type_name(self) -> str:
+        return xml_formats[self.type]["name"]
+
+    @property
+    def is_array(self) -> bool:
+        return self.doc._arrays[self.index]
+
+    @property
+    def offset(self) -> int:
+        """Absolute offset of the value in the document, -1 for void nodes"""
+        return self.doc._offsets[self.index]
+
+    @property
+    def value(self):
+        return self.doc._value(self.index)
+
+    @property
+    def attrs(self) -> dict[str, str]:
+        return self.doc._attr_dict(self.index)
+
+    @property
+    def children(self) -> list["LazyNode"]:
+        return [LazyNode(self.doc, i) for i in self.doc._children[self.index]]
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.doc._children[self.index])
+
+    def find(self, path: str) -> "LazyNode | None":
+        """First node matching a `/` separated path of child names"""
+        names = self.doc._names
+        children = self.doc._children
+        index = self.index
+        for name in path.split("/"):
+            for child in children[index]:
+                if names[child] == name:
+                    index = child
+                    break
+            else:
+                return None
+        return LazyNode(self.doc, index)
+
+    def findall(self, path: str) -> list["LazyNode"]:
+        names = self.doc._names
+        children = self.doc._children
+        found = [self.index]
+        for name in path.split("/"):
+            found = [c for i in found for c in children[i] if names[c] == name]
+        return [LazyNode(self.doc, i) for i in found]
+
+    def to_node(self) -> KBinNode:
+        """Fully decode this node and its descendants"""
+        # an explicit stack, so deep documents can't hit the recursion limit
+        doc = self.doc
+        children = doc._children
+        root = doc._node(self.index)
+        stack = [(root, iter(children[self.index]))]
+        while stack:
+            parent, indexes = stack[-1]
+            index = next(indexes, None)
+            if index is None:
+                stack.pop()
+            else:
+                node = doc._node(index)
+                parent.children.append(node)
+                stack.append((node, iter(children[index])))
+        return root
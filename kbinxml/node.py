@@ -0,0 +1,222 @@
+from .format_ids import format_values, xml_formats, xml_types
+from .kbinxml import (
+    BIN_ENCODING,
+    BINARY,
+    NODE_START,
+    STRING,
+    KBinWriter,
+    KBinXML,
+    iterparse,
+)
+from .xmlsupport import get_etree, is_element_tree
+
+_meta_attrs = ("__type", "__size", "__count")
+
+
+class KBinNode:
+    """A kbin node without lxml. `value` is already typed:
+    - None for void nodes
+    - bytes for `bin`, str for `str`
+    - int/float for single values, a flat tuple for vectors and arrays
+      (or `array.array`/NumPy arrays, see `from_binary`)
+    `attrs` maps attribute names to strings, exactly as stored in the binary.
+    """
+
+    __slots__ = ("name", "type", "value", "is_array", "attrs", "children")
+
+    def __init__(
+        self,
+        name,
+        type=NODE_START,
+        value=None,
+        attrs=None,
+        children=None,
+        is_array=False,
+    ):
+        self.name = name
+        self.type = xml_types[type] if isinstance(type, str) else type
+        self.value = value
+        self.is_array = is_array
+        self.attrs = {} if attrs is None else attrs
+        self.children = [] if children is None else children
+
+    @property
+    def type_name(self) -> str:
+        return xml_formats[self.type]["name"]
+
+    def __repr__(self):
+        return f"<KBinNode {self.name} ({self.type_name}) {self.value!r}>"
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+    def append(self, child: "KBinNode") -> "KBinNode":
+        self.children.append(child)
+        return child
+
+    def find(self, path: str) -> "KBinNode | None":
+        """First node matching a `/` separated path of child names"""
+        node = self
+        for name in path.split("/"):
+            for child in node.children:
+                if child.name == name:
+                    node = child
+                    break
+            else:
+                return None
+        return node
+
+    def iter(self):
+        """Depth first iteration over this node and all its descendants"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    @classmethod
+    def from_binary(
+        cls, input, convert_illegal_things=False, array_type=None
+    ) -> "KBinNode":
+        """`array_type` is passed on to `iterparse`, to get arrays as
+        `array.array` or NumPy arrays instead of tuples"""
+        root = cls("root")
+        stack = [root]
+        for event in iterparse(input, convert_illegal_things, array_type):
+            kind = event[0]
+            if kind == "start":
+                node = cls(event[1], event[2], is_array=event[3])
+                stack[-1].children.append(node)
+                stack.append(node)
+            elif kind == "value":
+                stack[-1].value = event[1]
+            elif kind == "attr":
+                stack[-1].attrs[event[1]] = event[2]
+            else:  # end
+                stack.pop()
+
+        # because we need the 'real' root
+        return root.children[0]
+
+    def to_binary(self, encoding=BIN_ENCODING, compressed=True) -> bytes:
+        writer = KBinWriter(encoding, compressed)
+        self.write(writer)
+        return writer.finish()
+
+    def to_binary_into(
+        self, buffer, offset=0, encoding=BIN_ENCODING, compressed=True
+    ) -> int:
+        """Encode into `buffer` at `offset`, see `KBinXML.to_binary_into`"""
+        writer = KBinWriter(encoding, compressed)
+        self.write(writer)
+        return writer.finish_into(buffer, offset)
+
+    def write(self, writer: KBinWriter):
+        """Write this node and its descendants to `writer`"""
+        # an explicit stack, so deep documents can't hit the recursion limit
+        writer.start(self.name, self.attrs, self.type, self.value, self.is_array)
+        stack = [iter(self.children)]
+        while stack:
+            child = next(stack[-1], None)
+            if child is None:
+                stack.pop()
+                writer.end()
+            else:
+                writer.start(
+                    child.name, child.attrs, child.type, child.value, child.is_array
+                )
+                stack.append(iter(child.children))
+
+    @classmethod
+    def from_element(cls, element) -> "KBinNode":
+        """Build from an lxml element, parsing `__type`/`__count` annotated
+        text the same way `KBinXML.to_binary` does"""
+        if is_element_tree(element):
+            element = element.getroot()
+        Element = get_etree().Element
+        root = cls._from_element(element)
+        stack = [(root, element.iterchildren(tag=Element))]
+        while stack:
+            parent, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+            else:
+                node = cls._from_element(child)
+                parent.children.append(node)
+                stack.append((node, child.iterchildren(tag=Element)))
+        return root
+
+    @classmethod
+    def _from_element(cls, element) -> "KBinNode":
+        """A single element, without its children"""
+        nodeType = element.attrib.get("__type")
+        if not nodeType:
+            # typeless tags with text become string
+            if element.text is not None and len(element.text.strip()) > 0:
+                nodeType = "str"
+            else:
+                nodeType = "void"
+        nodeId = xml_types[nodeType]
+        count = element.attrib.get("__count")
+        isArray = bool(count)
+
+        value = None
+        if nodeId != NODE_START:
+            fmt = xml_formats[nodeId]
+            text = element.text
+            if nodeId == BINARY:
+                value = bytes.fromhex(text)
+            elif nodeId == STRING:
+                value = "" if text is None else text
+            else:
+                value = tuple(map(fmt.get("fromStr", int), text.split(" ")))
+                if count and len(value) / fmt["count"] != int(count):
+                    raise ValueError("Array length does not match __count attribute")
+                if not isArray and fmt["count"] == 1:
+                    (value,) = value
+
+        attrs = {k: v for k, v in element.attrib.items() if k not in _meta_attrs}
+        return cls(element.tag, nodeId, value, attrs, None, isArray)
+
+    def to_element(self, convert_illegal_things=False):
+        """Convert to the same lxml tree `KBinXML.from_binary` would produce"""
+        # borrow KBinXML's namespace handling so the trees match exactly
+        kbin = KBinXML._from_tree(None, convert_illegal_things)
+        root = get_etree().Element("root")
+        stack = [(root, iter((self,)))]
+        while stack:
+            parent, nodes = stack[-1]
+            node = next(nodes, None)
+            if node is None:
+                stack.pop()
+            else:
+                stack.append((node._to_element(kbin, parent), iter(node.children)))
+        return root[0]
+
+    def _to_element(self, kbin, parent):
+        """Add this node, without its children, to `parent`"""
+        node = kbin._sub_element(parent, self.name)
+        if self.type != NODE_START:
+            fmt = xml_formats[self.type]
+            node.attrib["__type"] = fmt["name"]
+            value = self.value
+            if self.type == BINARY:
+                node.attrib["__size"] = str(len(value))
+                text = value.hex()
+            elif self.type == STRING:
+                text = value
+            else:
+                if self.is_array:
+                    node.attrib["__count"] = str(len(value) // fmt["count"])
+                elif fmt["count"] == 1:
+                    value = (value,)
+                text = format_values(fmt, value)
+            node.text = text.strip("\0")
+
+        for name, value in self.attrs.items():
+            node = kbin._set_attribute(node, name, value)
+        return node
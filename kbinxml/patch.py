@@ -0,0 +1,114 @@
+from .arrays import pack_array
+from .format_ids import xml_formats
+from .kbinxml import BINARY, NODE_START, STRING, KBinException, _u32
+from .lazy import KBinDocument, LazyNode
+from . import stringcache
+
+
+class KBinPatcher:
+    """Changes values in a binary document without decoding it.
+
+    The node section is scanned once (see `KBinDocument`) to find where
+    every value is. Fixed size values (`s8` to `u64`, `float`, `ip4`,
+    `time`, the vectors...) are then overwritten where they are, including
+    the 1 and 2 byte ones that share a dword with their neighbours.
+    Strings, binary, arrays and attributes are too, unless their padded
+    size changes: then only that value is re-encoded, and the rest of the
+    data section moves along with it, which keeps every later value
+    aligned the same way.
+
+    A bytearray `data` is patched in place. Any other writable buffer (eg
+    an mmap) is too, but can't change size. Read-only input is copied.
+    The result is identical to decoding, editing and encoding again.
+    """
+
+    def __init__(self, data, convert_illegal_things=False):
+        if not isinstance(data, bytearray):
+            with memoryview(data) as view:
+                if view.readonly:
+                    data = bytearray(data)
+        self.data = data
+        self.doc = KBinDocument(data, convert_illegal_things)
+
+    def node(self, path: str) -> LazyNode:
+        """The node at `path`, as for `KBinDocument.find`"""
+        node = self.doc.find(path)
+        if node is None:
+            raise KBinException(f"Document has no node at {path}")
+        return node
+
+    def _node(self, node) -> LazyNode:
+        return self.node(node) if isinstance(node, str) else node
+
+    def set(self, node, value):
+        """Change the value of `node` (a path or a `LazyNode` from `doc`).
+        Values are as for `KBinWriter.start`"""
+        node = self._node(node)
+        nodeType = node.type
+        if nodeType == NODE_START:
+            raise KBinException(f"{node.name} is a void node, it has no value")
+        fmt = xml_formats[nodeType]
+
+        if nodeType == STRING:
+            payload = stringcache.encode(value, self.doc.encoding, "replace") + b"\0"
+        elif nodeType == BINARY:
+            payload = bytes(value)
+        else:
+            if isinstance(value, (int, float)):
+                value = (value,)
+            if len(value) % fmt["count"] or (
+                not node.is_array and len(value) != fmt["count"]
+            ):
+                multiple = "a multiple of " if node.is_array else ""
+                raise ValueError(
+                    f"{fmt['name']} node {node.name} needs {multiple}"
+                    f"{fmt['count']} values, got {len(value)}"
+                )
+            if not node.is_array:
+                fmt["struct"].pack_into(self.data, node.offset, *value)
+                return
+            payload = pack_array(fmt["type"], value)
+        self._replace(node.offset, payload)
+
+    def set_attr(self, node, name: str, value: str):
+        """Change the value of attribute `name` of `node`"""
+        node = self._node(node)
+        for attr, offset in self.doc._attrs[node.index]:
+            if attr == name:
+                break
+        else:
+            raise KBinException(f"{node.name} has no attribute {name}")
+        self._replace(offset, stringcache.encode(value, self.doc.encoding) + b"\0")
+
+    def _replace(self, offset, payload):
+        data = self.data
+        oldSize = (_u32.unpack_from(data, offset)[0] + 4 + 3) & ~3
+        block = _u32.pack(len(payload)) + payload + bytes(-len(payload) % 4)
+        delta = len(block) - oldSize
+        if delta and not isinstance(data, bytearray):
+            raise KBinException("Changing the size of a value needs a bytearray")
+        data[offset : offset + oldSize] = block
+        if not delta:
+            return
+
+        doc = self.doc
+        doc.dataSize += delta
+        _u32.pack_into(data, doc._nodeEnd, doc.dataSize)
+        # everything after moved by whole dwords, so keeps its packing
+        doc._offsets = [o + delta if o > offset else o for o in doc._offsets]
+        doc._attrs = [
+            [(name, o + delta if o > offset else o) for name, o in attrs]
+            for attrs in doc._attrs
+        ]
+
+    def to_binary(self) -> bytes:
+        return bytes(self.data)
+
+
+def patch_binary(data, changes, convert_illegal_things=False) -> bytearray:
+    """Apply `changes`, a mapping of node path to new value, to a binary.
+    Returns the patched bytearray, which is `data` itself if it was one"""
+    patcher = KBinPatcher(data, convert_illegal_things)
+    for path, value in changes.items():
+        patcher.set(path, value)
+    return patcher.data
@@ -1,36 +1,101 @@
+from functools import lru_cache
+
 from kbinxml.bytebuffer import ByteBuffer
 
 
 charmap = "0123456789:ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
 bytemap = {c: i for i, c in enumerate(charmap)}
 
+# table driven conversion, so the hot loops handle two characters per step
+_pairs = [a + b for a in charmap for b in charmap]
+# ascii -> sixbit value, 0xFF for characters that can't be represented
+_char_values = bytes(bytemap.get(chr(i), 0xFF) for i in range(256))
+
+NAME_CACHE_SIZE = 1024
+
+
+def encode_sixbit(string: str) -> bytes:
+    """Packed form of `string`, including the leading length byte"""
+    try:
+        values = string.encode("ascii").translate(_char_values)
+    except UnicodeEncodeError:
+        values = b"\xff"
+    if 0xFF in values:
+        raise ValueError(f'Node name "{string}" cannot be sixbit encoded')
 
-def pack_sixbit(string: str, byteBuf: ByteBuffer):
-    chars = [bytemap[x] for x in string]
-    padding = 8 - (len(string) * 6 % 8)
-    if padding == 8:
-        padding = 0
     bits = 0
-    for c in chars:
-        bits <<= 6
-        bits |= c
+    for c in values:
+        bits = (bits << 6) | c
+    length_bits = len(string) * 6
+    padding = -length_bits % 8
     bits <<= padding
-    data = bits.to_bytes((len(string) * 6 + padding) // 8, byteorder="big")
-    byteBuf.append_bytes((len(string),))
-    byteBuf.append_bytes(data)
+    return bytes((len(string),)) + bits.to_bytes(
+        (length_bits + padding) // 8, byteorder="big"
+    )
+
+
+def decode_sixbit_bytes(packed: bytes) -> str:
+    """Inverse of `encode_sixbit`"""
+    length = packed[0]
+    padding = -(length * 6) % 8
+    bits = int.from_bytes(packed[1:], byteorder="big") >> padding
+    pairs = length // 2
+    shifts = range((pairs - 1) * 12, -1, -12)
+    result = [_pairs[(bits >> shift) & 0xFFF] for shift in shifts]
+    if length & 1:
+        return charmap[bits >> (pairs * 12)] + "".join(result)
+    return "".join(result)
+
+
+# names repeat constantly in real documents, so memoise them. Use
+# `configure_name_cache` to resize these and `name_cache_info` to inspect them
+_encode_sixbit = lru_cache(NAME_CACHE_SIZE)(encode_sixbit)
+_decode_sixbit = lru_cache(NAME_CACHE_SIZE)(decode_sixbit_bytes)
+
+
+def _encode_name(name: str, encoding: str) -> bytes:
+    return name.encode(encoding)
+
+
+def _decode_name(raw: bytes, encoding: str) -> str:
+    return raw.decode(encoding)
+
+
+encode_name = lru_cache(NAME_CACHE_SIZE)(_encode_name)
+decode_name = lru_cache(NAME_CACHE_SIZE)(_decode_name)
+
+
+def configure_name_cache(maxsize: int | None = NAME_CACHE_SIZE):
+    """Resize (and clear) the node name caches. 0 disables caching, None
+    makes them unbounded"""
+    global _encode_sixbit, _decode_sixbit, encode_name, decode_name
+    _encode_sixbit = lru_cache(maxsize)(encode_sixbit)
+    _decode_sixbit = lru_cache(maxsize)(decode_sixbit_bytes)
+    encode_name = lru_cache(maxsize)(_encode_name)
+    decode_name = lru_cache(maxsize)(_decode_name)
+
+
+def name_cache_info() -> dict:
+    """Hit and miss counters for each of the node name caches"""
+    return {
+        "sixbit_encode": _encode_sixbit.cache_info(),
+        "sixbit_decode": _decode_sixbit.cache_info(),
+        "encode": encode_name.cache_info(),
+        "decode": decode_name.cache_info(),
+    }
+
+
+def pack_sixbit(string: str, byteBuf: ByteBuffer):
+    byteBuf.append_bytes(_encode_sixbit(string))
+
+
+def decode_sixbit(data, offset: int = 0) -> tuple[str, int]:
+    """Decode a sixbit name straight from `data`, which may be any buffer
+    (bytes, memoryview, mmap). Returns the name and the offset after it"""
+    end = offset + 1 + (data[offset] * 6 + 7) // 8
+    return _decode_sixbit(bytes(data[offset:end])), end
 
 
 def unpack_sixbit(byteBuf: ByteBuffer):
-    length = byteBuf.get_u8()
-    length_bits = length * 6
-    length_bytes = (length_bits + 7) // 8
-    padding = 8 - (length_bits % 8)
-    if padding == 8:
-        padding = 0
-    bits = int.from_bytes(byteBuf.get_bytes(length_bytes), byteorder="big")
-    bits >>= padding
-    result = []
-    for _ in range(length):
-        result.append(bits & 0b111111)
-        bits >>= 6
-    return "".join([charmap[x] for x in result[::-1]])
+    name, byteBuf.offset = decode_sixbit(byteBuf.data, byteBuf.offset)
+    return name
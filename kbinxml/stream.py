@@ -0,0 +1,196 @@
+from typing import TYPE_CHECKING
+
+from .kbinxml import KBinException, KBinReader, KBinXML, _u32, parse_header
+from .instrument import get_instrumentation, phase
+
+if TYPE_CHECKING:
+    # imported when used, it's slow to import and most users never need it
+    import asyncio
+
+# documents at least this big are decoded off the event loop
+OFFLOAD_SIZE = 64 * 1024
+# sizes come from the header, so limit them before allocating anything
+MAX_SIZE = 64 * 1024 * 1024
+
+
+class _FeedReader(KBinReader):
+    """A reader over a buffer that is still being filled. `events` yields
+    None whenever the next value hasn't arrived yet, and carries on from
+    there once more has been received"""
+
+    def __init__(self, buffer, received, **kwargs):
+        self.received = received
+        super().__init__(buffer, **kwargs)
+        self.total = len(buffer)
+
+    def _wait(self, end):
+        end = min(end, self.total)
+        while self.received < end:
+            yield None
+
+    def _wait_data(self, size):
+        # the node section is always complete by now, only values can be late
+        offset = self.dataBuf.offset
+        if size is None:
+            yield from self._wait(offset + 4)
+            size = 4 + self.dataBuf.peek_u32()
+        else:
+            # 1 and 2 byte values may go in an earlier dword, but never later
+            size = max(size, 4)
+        yield from self._wait(offset + size)
+
+
+class KBinFeedParser:
+    """Push-style decoder for documents that arrive in pieces, like lxml's
+    `XMLPullParser`. `feed` it chunks as they are received and `close` it at
+    the end to get the `KBinXML`.
+
+    The header says how big the document is, so the buffer is allocated
+    once and chunks are copied straight into it. Nodes are decoded (and the
+    tree built) as soon as their values have arrived, so by the time the
+    last chunk comes in there is very little work left. With `events`,
+    `read_events` also gives the `KBinReader` events decoded so far.
+
+    Documents whose header says they are bigger than `max_size` bytes (None
+    for no limit) are rejected before anything is allocated for them.
+
+    The tree is an lxml one, so this needs lxml."""
+
+    def __init__(
+        self,
+        convert_illegal_things=False,
+        events=False,
+        instrumentation=None,
+        max_size=MAX_SIZE,
+    ):
+        self.doc = KBinXML._from_tree(None, convert_illegal_things, instrumentation)
+        self.instrumentation = get_instrumentation(instrumentation)
+        self.max_size = max_size
+
+        self._buffer = bytearray()
+        self._received = 0
+        self._reader = None
+        self._events = None
+        self._builder = None
+        self._pending = [] if events else None
+        self._done = False
+
+    @property
+    def size(self) -> int | None:
+        """Total size of the document, once its header has been received"""
+        return None if self._reader is None else self._reader.total
+
+    def feed(self, data):
+        if self._reader is None:
+            self._buffer += data
+            self._received = len(self._buffer)
+            self._start()
+        else:
+            end = self._received + len(data)
+            if end > len(self._buffer):
+                raise KBinException("Data fed after the end of the kbin document")
+            self._buffer[self._received : end] = data
+            self._received = self._reader.received = end
+        if self._events is not None:
+            with phase(self.instrumentation, "feed"):
+                self._advance()
+
+    def _start(self):
+        buffer = self._buffer
+        if self._received >= 2 and not KBinXML.is_binary_xml(buffer):
+            raise KBinException("Input is not a kbin document")
+        if self._received < 8:
+            return
+        nodeEnd = parse_header(buffer).node_size + 8
+        _check_size(nodeEnd + 4, self.max_size)
+        if self._received < nodeEnd + 4:
+            return
+        total = nodeEnd + 4 + _u32.unpack_from(buffer, nodeEnd)[0]
+        _check_size(total, self.max_size)
+        if self._received > total:
+            raise KBinException("Data fed after the end of the kbin document")
+
+        # the whole document from here on, filled in as it arrives
+        self._buffer = bytearray(total)
+        self._buffer[: self._received] = buffer
+        self._reader = _FeedReader(
+            self._buffer,
+            self._received,
+            convert_illegal_things=self.doc.convert_illegal_things,
+            instrumentation=self.instrumentation,
+        )
+        self.doc._reader_defaults(self._reader)
+        self._events = self._reader.events()
+        self._builder = self.doc._tree_builder()
+        next(self._builder)
+
+    def _advance(self):
+        send = self._builder.send
+        pending = self._pending
+        for event in self._events:
+            if event is None:
+                return
+            send(event)
+            if pending is not None:
+                pending.append(event)
+        self._done = True
+
+    def read_events(self) -> list[tuple]:
+        """Events decoded since the last call"""
+        if self._pending is None:
+            raise KBinException("Create the parser with events=True to read events")
+        events, self._pending = self._pending, []
+        return events
+
+    def close(self) -> KBinXML:
+        """Finish decoding. Raises `KBinException` if the document was cut
+        short"""
+        if not self._done or self._received < len(self._buffer):
+            raise KBinException("kbin document is incomplete")
+        self._builder.close()
+        self._reader.close()
+        return self.doc
+
+
+def _check_size(size, max_size):
+    if max_size is not None and size > max_size:
+        raise KBinException(f"kbin document is over the {max_size} byte limit")
+
+
+async def read_document(reader: "asyncio.StreamReader", max_size=MAX_SIZE) -> bytes:
+    """Read exactly one kbin document from `reader`, using the sizes in its
+    header. Documents over `max_size` bytes are rejected, as for
+    `KBinFeedParser`"""
+    import asyncio
+
+    try:
+        header = await reader.readexactly(8)
+        nodeSize = parse_header(header).node_size + 4
+        _check_size(8 + nodeSize, max_size)
+        nodes = await reader.readexactly(nodeSize)
+        dataSize = _u32.unpack_from(nodes, len(nodes) - 4)[0]
+        _check_size(8 + nodeSize + dataSize, max_size)
+        data = await reader.readexactly(dataSize)
+    except asyncio.IncompleteReadError as e:
+        raise KBinException("Stream ended before the kbin document did") from e
+    return b"".join((header, nodes, data))
+
+
+async def decode_stream(
+    reader: "asyncio.StreamReader",
+    convert_illegal_things=False,
+    executor=None,
+    offload_size=OFFLOAD_SIZE,
+    max_size=MAX_SIZE,
+) -> KBinXML:
+    """Read one kbin document from `reader` and decode it. Documents of at
+    least `offload_size` bytes are decoded in `executor` (the loop's default
+    one if None) so they don't block the event loop, and ones over
+    `max_size` bytes are rejected"""
+    data = await read_document(reader, max_size)
+    if len(data) < offload_size:
+        return KBinXML(data, convert_illegal_things)
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, KBinXML, data, convert_illegal_things)
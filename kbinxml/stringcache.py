@@ -0,0 +1,72 @@
+"""Optional memoisation of string values (node text and attributes).
+
+The same short strings tend to repeat thousands of times in a document, so
+with the cache on, converting a repeat is a dict lookup instead of a codec
+call. It is off by default, turn it on with `configure_string_cache`.
+
+Only strict conversions are cached. A decode that fails still raises, or
+takes the `convert_illegal_things` fallback, every time.
+"""
+
+from functools import lru_cache
+
+# longer strings rarely repeat, and would make the cache hold a lot of memory
+MAX_CACHED_LENGTH = 64
+
+_max_length = MAX_CACHED_LENGTH
+_cached_decode = None
+_cached_encode = None
+
+
+def _decode(data: bytes, encoding: str) -> str:
+    return data.decode(encoding)
+
+
+def _encode(string: str, encoding: str, errors: str) -> bytes:
+    return string.encode(encoding, errors)
+
+
+def decode(data: bytes, encoding: str) -> str:
+    """`data.decode(encoding)`, from the cache if it's on"""
+    if _cached_decode is None or len(data) > _max_length:
+        return data.decode(encoding)
+    return _cached_decode(data, encoding)
+
+
+def encode(string: str, encoding: str, errors: str = "strict") -> bytes:
+    """`string.encode(encoding, errors)`, from the cache if it's on"""
+    if _cached_encode is None or len(string) > _max_length:
+        return string.encode(encoding, errors)
+    return _cached_encode(string, encoding, errors)
+
+
+def configure_string_cache(maxsize: int | None = 0, max_length=MAX_CACHED_LENGTH):
+    """Resize (and clear) the string caches, evicting the least recently
+    used entries past `maxsize` strings each. 0 turns them off, None makes
+    them unbounded. Strings longer than `max_length` are never cached"""
+    global _cached_decode, _cached_encode, _max_length
+    _max_length = max_length
+    if maxsize == 0:
+        _cached_decode = _cached_encode = None
+    else:
+        _cached_decode = lru_cache(maxsize)(_decode)
+        _cached_encode = lru_cache(maxsize)(_encode)
+
+
+def _info(cache) -> dict | None:
+    if cache is None:
+        return None
+    info = cache.cache_info()._asdict()
+    lookups = info["hits"] + info["misses"]
+    info["hit_rate"] = info["hits"] / lookups if lookups else 0.0
+    return info
+
+
+def string_cache_info() -> dict:
+    """Hits, misses, sizes and hit rate of the encode and decode caches,
+    None for each while caching is off"""
+    return {
+        "encode": _info(_cached_encode),
+        "decode": _info(_cached_decode),
+        "max_length": _max_length,
+    }
@@ -0,0 +1,215 @@
+from collections.abc import Mapping
+from struct import Struct
+
+from .arrays import pack_array
+from .format_ids import xml_formats
+from .kbinxml import (
+    BIN_ENCODING,
+    BINARY,
+    NODE_START,
+    STRING,
+    KBinException,
+    KBinWriter,
+    KBinXML,
+    _u32,
+    parse_header,
+)
+from .layout import DataLayout
+from .node import KBinNode
+from .xmlsupport import is_element, is_element_tree
+from . import stringcache
+
+# data section plan operations
+_CONST = 0  # pre-encoded bytes, eg attribute values
+_FIXED = 1  # a run of fixed size values packed by one Struct
+_BYTE = 2  # 1 byte value packed into a shared dword
+_WORD = 3  # 2 byte value packed into a shared dword
+_STRING = 4
+_BINARY = 5
+_ARRAY = 6
+
+
+class KBinTemplate:
+    """A document shape compiled once, so responses that only differ in
+    their values can skip tree encoding entirely.
+
+    The node section (names, types, attributes) is encoded at compile time.
+    Rendering only packs the values into the data section, following a plan
+    that already knows which values share packed dwords and which runs of
+    fixed size values can be packed together. The output is identical to
+    `KBinXML.to_binary` for the same tree.
+
+    Every typed node is a value slot, addressed by its index or by its path
+    (see `slots`). Attribute values are part of the template.
+    """
+
+    def __init__(self, source, encoding=BIN_ENCODING, compressed=True):
+        """`source` can be XML text, an lxml element/tree, a KBinXML or a
+        KBinNode. Its values become the defaults for `render`"""
+        root = _as_node(source)
+        self.encoding = encoding
+        self.compressed = compressed
+
+        writer = KBinWriter(encoding, compressed)
+        root.write(writer)
+        binary = writer.finish()
+        # everything up to (not including) the data section size
+        nodeEnd = parse_header(binary).node_size + 8
+        self._prefix = binary[:nodeEnd]
+
+        self.slots: list[str] = []
+        self.defaults: list = []
+        self._plan: list[tuple] = []
+        self._walk(root)
+        self._plan = [
+            (op, Struct(">" + arg) if op == _FIXED else arg, slot)
+            for op, arg, slot in self._plan
+        ]
+        self._slot_index = {path: i for i, path in enumerate(self.slots)}
+
+    def _walk(self, root: KBinNode):
+        # an explicit stack, so deep documents can't hit the recursion limit
+        stack = [iter(((root, root.name),))]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+                continue
+            node, path = item
+            if node.type != NODE_START:
+                self._add_slot(node, path)
+
+            # sorted, because KBinWriter sorts them
+            for key in sorted(node.attrs):
+                data = node.attrs[key].encode(self.encoding) + b"\0"
+                data = _u32.pack(len(data)) + data + _padding(len(data))
+                self._add_op(_CONST, data, None)
+
+            stack.append(iter(_child_paths(node, path)))
+
+    def _add_slot(self, node: KBinNode, path: str):
+        slot = len(self.slots)
+        self.slots.append(path)
+        self.defaults.append(node.value)
+        fmt = xml_formats[node.type]
+        if node.type == STRING:
+            self._add_op(_STRING, None, slot)
+        elif node.type == BINARY:
+            self._add_op(_BINARY, None, slot)
+        elif node.is_array:
+            self._add_op(_ARRAY, fmt["type"], slot)
+        elif fmt["struct"].size == 1:
+            self._add_op(_BYTE, fmt["struct"], slot)
+        elif fmt["struct"].size == 2:
+            self._add_op(_WORD, fmt["struct"], slot)
+        else:
+            size = fmt["struct"].size
+            spec = f"{fmt['count']}{fmt['type']}" + "x" * (-size % 4)
+            self._add_op(_FIXED, spec, slot)
+
+    def _add_op(self, op, arg, slot):
+        # merge runs of constants and of fixed size values, they are always
+        # written back to back at the end of the data section
+        if self._plan and self._plan[-1][0] == op:
+            _, lastArg, lastSlot = self._plan[-1]
+            if op == _CONST:
+                self._plan[-1] = (op, lastArg + arg, None)
+                return
+            elif op == _FIXED:
+                self._plan[-1] = (op, lastArg + arg, lastSlot + [slot])
+                return
+        if op == _FIXED:
+            slot = [slot]
+        self._plan.append((op, arg, slot))
+
+    def slot(self, path: str) -> int:
+        """Index of the value slot at `path`, eg `response/player/name` or
+        `response/entry[2]` when a node has same-named siblings"""
+        try:
+            return self._slot_index[path]
+        except KeyError:
+            raise KBinException(f"Template has no value at {path}") from None
+
+    def render(self, values=None) -> bytes:
+        """Encode the template with new values. `values` is either a full
+        sequence in slot order, or a mapping of slot index or path to value,
+        with anything missing taken from `defaults`"""
+        if values is None:
+            values = self.defaults
+        elif isinstance(values, Mapping):
+            merged = list(self.defaults)
+            for key, value in values.items():
+                merged[key if isinstance(key, int) else self.slot(key)] = value
+            values = merged
+        elif len(values) != len(self.slots):
+            raise KBinException(
+                f"Template has {len(self.slots)} values, {len(values)} were given"
+            )
+
+        encoding = self.encoding
+        data = bytearray()
+        layout = DataLayout()
+        for op, arg, slot in self._plan:
+            if op == _CONST:
+                data += arg
+            elif op == _FIXED:
+                args = []
+                for i in slot:
+                    value = values[i]
+                    if isinstance(value, (int, float)):
+                        args.append(value)
+                    else:
+                        args.extend(value)
+                data += arg.pack(*args)
+            elif op == _BYTE or op == _WORD:
+                value = values[slot]
+                if not isinstance(value, (int, float)):
+                    value = tuple(value)
+                else:
+                    value = (value,)
+                layout.offset = len(data)
+                offset = layout.fixed(1 if op == _BYTE else 2)
+                if layout.offset > len(data):
+                    data += b"\0\0\0\0"
+                arg.pack_into(data, offset, *value)
+            else:
+                value = values[slot]
+                if op == _STRING:
+                    value = stringcache.encode(value, encoding, "replace") + b"\0"
+                elif op == _ARRAY:
+                    value = pack_array(arg, value)
+                data += _u32.pack(len(value))
+                data += value
+                data += _padding(len(value))
+
+        return self._prefix + _u32.pack(len(data)) + data
+
+
+def _padding(length):
+    return b"\0" * (-length % 4)
+
+
+def _child_paths(node: KBinNode, path: str) -> list:
+    """`node`'s children and their slot paths"""
+    counts = {}
+    for child in node.children:
+        counts[child.name] = counts.get(child.name, 0) + 1
+    seen = {}
+    paths = []
+    for child in node.children:
+        childPath = f"{path}/{child.name}"
+        if counts[child.name] > 1:
+            seen[child.name] = seen.get(child.name, 0) + 1
+            childPath += f"[{seen[child.name]}]"
+        paths.append((child, childPath))
+    return paths
+
+
+def _as_node(source) -> KBinNode:
+    if isinstance(source, KBinNode):
+        return source
+    if is_element(source) or is_element_tree(source):
+        return KBinNode.from_element(source)
+    if not isinstance(source, KBinXML):
+        source = KBinXML(source)
+    return KBinNode.from_element(source.xml_doc)
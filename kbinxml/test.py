@@ -1,4 +1,34 @@
-from .kbinxml import KBinXML
+import array
+import asyncio
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stderr, redirect_stdout
+from io import BytesIO, StringIO
+
+from .arrays import get_numpy, pack_array
+from .batch import run_batch
+from .bytebuffer import ByteBuffer
+from .cache import EncodeCache, fingerprint
+from .codec import KBinCodec
+from .emitter import binary_to_text
+from .encoder import encode_text
+from .instrument import Instrumentation
+from .kbinxml import KBinException, KBinWriter, KBinXML, iterparse
+from .layout import DataLayout
+from .lazy import KBinDocument
+from .node import KBinNode
+from .patch import KBinPatcher
+from .sixbit import configure_name_cache, name_cache_info
+from .stringcache import configure_string_cache, string_cache_info
+from .stream import KBinFeedParser, decode_stream, read_document
+from .template import KBinTemplate
+from .transcode import transcode
+from .validate import inspect_header, validate
+
+numpy = get_numpy()
 
 with open("testcases.xml", "rb") as f:
     xml_in = f.read()
@@ -16,6 +46,19 @@ if kbin != expected_bin:
 else:
     print("XML -> Binary correct!")
 
+if k.mem_size != k.encode().mem_size or k.encode_result.node_count != 75:
+    raise AssertionError("Encode statistics do not match")
+edited = KBinXML(xml_in)
+before = edited.mem_size
+edited.xml_doc.find("superstar").text = "x" * 1000
+if (
+    edited.mem_size == before
+    or edited.mem_size != KBinXML(edited.to_text().encode()).mem_size
+):
+    raise AssertionError("Encode statistics were not updated after an edit")
+else:
+    print("Encode statistics correct!")
+
 backwards = KBinXML(kbin)
 btext = backwards.to_text()
 if btext != expected_xml:
@@ -24,3 +67,543 @@ if btext != expected_xml:
     raise AssertionError("XML putput does not match, check failed_test.xml")
 else:
     print("Binary -> XML correct!")
+
+# files are memory-mapped, which must be let go of even when decoding fails
+with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "testcases_out.kbin")
+    with open(path, "wb") as f:
+        f.write(expected_bin)
+    if KBinXML.from_file(path).to_text() != expected_xml:
+        raise AssertionError("from_file output does not match")
+    with open(path, "wb") as f:
+        f.write(expected_bin[:200])
+    try:
+        KBinXML.from_file(path)
+    except (KBinException, struct.error):
+        print("Decode from file correct!")
+    else:
+        raise AssertionError("Truncated file decoded without error")
+
+native = KBinNode.from_binary(expected_bin)
+if native.to_binary() != expected_bin:
+    raise AssertionError("Native node binary output does not match")
+if KBinXML(native.to_element()).to_text() != expected_xml:
+    raise AssertionError("Native node lxml conversion does not match")
+if KBinNode.from_binary(expected_bin, array_type="array").to_binary() != expected_bin:
+    raise AssertionError("Native node array.array round trip does not match")
+else:
+    print("Native node round trip correct!")
+
+# deeper than the recursion limit
+writer = KBinWriter()
+for depth in range(1200):
+    writer.start(f"n{depth}")
+writer.value("leaf", "u8", 1)
+for depth in range(1200):
+    writer.end()
+deep_bin = writer.finish()
+deep = KBinNode.from_binary(deep_bin)
+if deep.to_binary() != deep_bin:
+    raise AssertionError("Deep native node binary output does not match")
+if KBinNode.from_element(deep.to_element()).to_binary() != deep_bin:
+    raise AssertionError("Deep native node lxml conversion does not match")
+else:
+    print("Deep native node correct!")
+
+lazy = KBinDocument(expected_bin)
+if lazy.root.to_node().to_binary() != expected_bin:
+    raise AssertionError("Lazy document values do not match")
+if lazy.value("test/superstar") != native.find("superstar").value:
+    raise AssertionError("Lazy document path lookup does not match")
+else:
+    print("Lazy document correct!")
+
+if KBinDocument(deep_bin).root.to_node().to_binary() != deep_bin:
+    raise AssertionError("Deep lazy document values do not match")
+else:
+    print("Deep lazy document correct!")
+
+# out of range values fail the same way, whatever sequence holds them
+wide = [1, -(2**40)]
+sequences = [wide, array.array("q", wide)]
+if numpy is not None:
+    sequences += [numpy.array(wide), numpy.array([1.0, 2.5])]
+for values in sequences:
+    try:
+        pack_array("i", values)
+    except struct.error:
+        pass
+    else:
+        raise AssertionError(f"Out of range {values!r} packed without error")
+if numpy is not None and pack_array("i", numpy.array([1, -2])) != struct.pack(
+    ">2i", 1, -2
+):
+    raise AssertionError("NumPy array packing does not match")
+else:
+    print("Array packing correct!")
+
+events = list(iterparse(expected_bin))
+if events[:12] != [
+    ("start", "test", 1, False),
+    ("start", "entry", 12, True),
+    ("value", (2130706433, 3232235521)),
+    ("end", "entry"),
+    ("start", "entry", 11, False),
+    ("value", "Hello, world!"),
+    ("attr", "attr", "test"),
+    ("attr", "attr2", "best"),
+    ("end", "entry"),
+    ("start", "superstar", 11, False),
+    ("value", "シ　イス　マイ　ワイフ"),
+    ("attr", "babe", "ミツル"),
+]:
+    raise AssertionError("Event stream does not match")
+if events[-3:] != [("value", (1,) + (0,) * 15), ("end", "entry"), ("end", "test")]:
+    raise AssertionError("Event stream ending does not match")
+counts = {kind: sum(e[0] == kind for e in events) for kind in ("start", "end")}
+if counts != {"start": 75, "end": 75} or len(events) != 75 + 72 + 4 + 75:
+    raise AssertionError("Event counts do not match")
+else:
+    print("Event stream correct!")
+
+writer = KBinWriter()
+writer.start("root", {"attr": "test"})
+writer.value("scalar", "u8", 12)
+writer.value("vector", "2u8", (8, 9))
+writer.value("array", "s32", [1, -2, 3])
+writer.value("text", "str", "Hello, world!")
+writer.end()
+text_equivalent = b"""<root attr="test"><scalar __type="u8">12</scalar>
+    <vector __type="2u8">8 9</vector><array __type="s32" __count="3">1 -2 3</array>
+    <text __type="str">Hello, world!</text></root>"""
+xml_equivalent = KBinXML(text_equivalent)
+if writer.finish() != xml_equivalent.to_binary():
+    raise AssertionError("Streaming writer output does not match")
+else:
+    print("Streaming writer correct!")
+
+template = KBinTemplate(xml_in)
+if template.render() != expected_bin:
+    raise AssertionError("Template output does not match")
+native.find("superstar").value = "Hello, template!"
+if template.render({"test/superstar": "Hello, template!"}) != native.to_binary():
+    raise AssertionError("Template output with new values does not match")
+else:
+    print("Template correct!")
+
+if KBinTemplate(deep).render() != deep_bin:
+    raise AssertionError("Deep template output does not match")
+else:
+    print("Deep template correct!")
+
+with tempfile.TemporaryDirectory() as tmp:
+    src = os.path.join(tmp, "src")
+    os.makedirs(os.path.join(src, "sub"))
+    os.makedirs(os.path.join(src, "other"))
+    for name, data in (
+        ("a.xml", xml_in),
+        ("sub/b.bin", expected_bin),
+        ("other/a.xml", xml_in),
+        ("bad.xml", b"<unclosed>"),
+    ):
+        with open(os.path.join(src, name), "wb") as f:
+            f.write(data)
+
+    def batch(patterns, output_dir):
+        with redirect_stdout(StringIO()), redirect_stderr(StringIO()) as errors:
+            code = run_batch(patterns, output_dir, jobs=1)
+        return code, errors.getvalue()
+
+    def read(*path):
+        with open(os.path.join(tmp, *path), "rb") as f:
+            return f.read()
+
+    # a directory, keeping its structure, with a failing file
+    code, errors = batch([src], os.path.join(tmp, "dir"))
+    if (
+        code != 1
+        or "bad.xml" not in errors
+        or os.path.exists(os.path.join(tmp, "dir", "bad.bin"))
+    ):
+        raise AssertionError("Batch conversion did not report the failing file")
+    if (
+        read("dir", "a.bin") != expected_bin
+        or read("dir", "other", "a.bin") != expected_bin
+    ):
+        raise AssertionError("Batch directory conversion output does not match")
+    if read("dir", "sub", "b.xml").decode("utf-8") != expected_xml:
+        raise AssertionError("Batch directory conversion text does not match")
+    # a glob
+    code, errors = batch([os.path.join(src, "**", "b.*")], os.path.join(tmp, "glob"))
+    if code != 0 or read("glob", "sub", "b.xml").decode("utf-8") != expected_xml:
+        raise AssertionError("Batch glob conversion output does not match")
+    # plain files with the same name would overwrite each other
+    files = [os.path.join(src, "a.xml"), os.path.join(src, "other", "a.xml")]
+    code, errors = batch(files, os.path.join(tmp, "files"))
+    if (
+        code != 1
+        or errors.count("also the output") != 2
+        or os.path.exists(os.path.join(tmp, "files"))
+    ):
+        raise AssertionError("Batch conversion did not catch clashing outputs")
+    # in place
+    code, errors = batch([os.path.join(src, "a.xml")], None)
+    if code != 0 or read("src", "a.xml") != expected_bin:
+        raise AssertionError("Batch in place conversion output does not match")
+    else:
+        print("Batch conversion correct!")
+
+stats = Instrumentation()
+KBinXML(KBinXML(xml_in, instrumentation=stats).to_binary(), instrumentation=stats)
+snapshot = stats.snapshot()
+if sum(snapshot["node_types"].values()) != 2 * 75:
+    raise AssertionError("Instrumentation node counts do not match")
+if snapshot["bytes_read"] != snapshot["bytes_written"]:
+    raise AssertionError("Instrumentation byte counts do not match")
+if snapshot["phases"]["from_binary"]["calls"] != 1:
+    raise AssertionError("Instrumentation phases do not match")
+writer = KBinWriter()
+writer.start("root", {"attr": "xx"})
+writer.end()
+bad_bin = writer.finish().replace(b"xx\0", "\u00df".encode("utf-8") + b"\0")
+with redirect_stderr(StringIO()):
+    KBinXML(bad_bin, convert_illegal_things=True, instrumentation=stats)
+if stats.string_fallbacks != 1:
+    raise AssertionError("Instrumentation string fallbacks do not match")
+else:
+    print("Instrumentation correct!")
+
+feed = KBinFeedParser()
+for i in range(0, len(expected_bin), 7):
+    feed.feed(expected_bin[i : i + 7])
+if feed.close().to_text() != expected_xml:
+    raise AssertionError("Feed parser output does not match")
+stream = asyncio.StreamReader()
+stream.feed_data(expected_bin)
+stream.feed_eof()
+if asyncio.run(decode_stream(stream, offload_size=0)).to_text() != expected_xml:
+    raise AssertionError("Stream decoder output does not match")
+else:
+    print("Feed parser correct!")
+
+feed = KBinFeedParser(events=True)
+fed_events = []
+for i in range(0, len(expected_bin), 3):
+    feed.feed(expected_bin[i : i + 3])
+    fed_events += feed.read_events()
+if fed_events != list(iterparse(expected_bin)):
+    raise AssertionError("Feed parser events do not match")
+else:
+    print("Feed parser events correct!")
+
+
+async def read_bytes(data, **kwargs):
+    stream = asyncio.StreamReader()
+    stream.feed_data(data)
+    stream.feed_eof()
+    return await read_document(stream, **kwargs)
+
+
+# sizes in the header are checked before they're allocated
+# a 4 byte node section, then a 1 GiB data section
+huge = expected_bin[:4] + struct.pack(">IiI", 4, -1, 2**30)
+for data, limits in ((huge, {}), (expected_bin, {"max_size": len(expected_bin) - 1})):
+    try:
+        KBinFeedParser(**limits).feed(data)
+    except KBinException:
+        pass
+    else:
+        raise AssertionError("Feed parser allocated an oversized document")
+    try:
+        asyncio.run(read_bytes(data, **limits))
+    except KBinException:
+        pass
+    else:
+        raise AssertionError("Stream reader read an oversized document")
+feed = KBinFeedParser(max_size=None)
+feed.feed(expected_bin)
+if feed.close().to_text() != expected_xml:
+    raise AssertionError("Unlimited feed parser output does not match")
+if asyncio.run(read_bytes(expected_bin, max_size=len(expected_bin))) != expected_bin:
+    raise AssertionError("Stream reader output at the size limit does not match")
+# abandoned before any node arrived
+builder = KBinXML._from_tree(None)._tree_builder()
+next(builder)
+builder.close()
+print("Feed parser limits correct!")
+
+if binary_to_text(expected_bin) != expected_xml:
+    raise AssertionError("Text emitter output does not match")
+if binary_to_text(KBinXML(xml_in).to_binary(compressed=False)) != expected_xml:
+    raise AssertionError("Text emitter uncompressed output does not match")
+else:
+    print("Text emitter correct!")
+
+with open("testcases.xml", "rb") as f:
+    streamed = encode_text(f, compressed=False).binary
+if encode_text(xml_in) != KBinXML(xml_in).encode():
+    raise AssertionError("Streaming encoder output does not match")
+if streamed != KBinXML(xml_in).to_binary(compressed=False):
+    raise AssertionError("Streaming encoder file output does not match")
+else:
+    print("Streaming encoder correct!")
+
+codec = KBinCodec()
+# twice, the second time with pooled buffers
+if codec.encode(xml_in) != expected_bin or codec.encode(xml_in) != expected_bin:
+    raise AssertionError("Codec output does not match")
+if codec.encode(codec.decode(expected_bin)) != expected_bin:
+    raise AssertionError("Codec round trip does not match")
+else:
+    print("Codec correct!")
+
+buf = ByteBuffer()
+buf.append_bytes(b"hello")
+if len(buf) != 5 or bytes(buf.getbuffer()) != b"hello":
+    raise AssertionError("Byte buffer length does not match what was written")
+read_only = ByteBuffer(b"ab")
+read_only.append_u8(1)
+if len(read_only) != 3 or bytes(read_only.getbuffer()) != b"ab\x01":
+    raise AssertionError("Byte buffer append to read-only input does not match")
+reused = ByteBuffer(bytearray(b"old data"), end=0)
+reused.append_u16(1)
+if len(reused) != 2 or bytes(reused.getbuffer()) != b"\0\x01":
+    raise AssertionError("Byte buffer reuse does not match")
+else:
+    print("Byte buffer correct!")
+
+into = bytearray(len(expected_bin) + 8)
+written = KBinXML(xml_in).to_binary_into(into, 8)
+if written != len(expected_bin) or into[8:] != expected_bin:
+    raise AssertionError("Encode into buffer output does not match")
+written = codec.encode_into(xml_in, memoryview(into)[4:], 4)
+if into[8:] != expected_bin:
+    raise AssertionError("Codec encode into buffer output does not match")
+try:
+    KBinXML(xml_in).to_binary_into(bytearray(len(expected_bin) - 1))
+except ValueError:
+    print("Encode into buffer correct!")
+else:
+    raise AssertionError("Encode into a too small buffer did not fail")
+
+configure_string_cache(256)
+if KBinXML(xml_in).to_binary() != expected_bin:
+    raise AssertionError("String cache output does not match")
+if KBinXML(expected_bin).to_text() != expected_xml:
+    raise AssertionError("String cache text output does not match")
+if KBinXML(KBinXML(xml_in).to_binary()).to_text() != expected_xml:
+    raise AssertionError("String cache repeated output does not match")
+info = string_cache_info()
+if not info["encode"]["hits"] or not info["decode"]["hits"]:
+    raise AssertionError("String cache was never hit")
+stats = Instrumentation()
+with redirect_stderr(StringIO()):
+    KBinXML(bad_bin, convert_illegal_things=True, instrumentation=stats)
+    KBinXML(bad_bin, convert_illegal_things=True, instrumentation=stats)
+configure_string_cache(0)
+if stats.string_fallbacks != 2:
+    raise AssertionError("String cache skipped the fallback")
+else:
+    print("String cache correct!")
+
+# 79 names (75 nodes and 4 attributes), 12 of them different
+uncompressed_bin = KBinXML(xml_in).to_binary(compressed=False)
+configure_name_cache(None)
+KBinNode.from_binary(expected_bin)
+KBinNode.from_binary(expected_bin)
+KBinNode.from_binary(uncompressed_bin)
+info = name_cache_info()
+if info["sixbit_decode"][:2] != (146, 12) or info["decode"][:2] != (67, 12):
+    raise AssertionError("Name cache counters do not match")
+configure_name_cache(0)
+uncached = KBinNode.from_binary(expected_bin)
+info = name_cache_info()
+configure_name_cache()
+if info["sixbit_decode"][:2] != (0, 79) or uncached.to_binary() != expected_bin:
+    raise AssertionError("Disabled name cache does not match")
+else:
+    print("Name cache correct!")
+
+# worked out by hand: 1 and 2 byte values fill shared dwords, everything
+# else is dword aligned
+layout = DataLayout()
+placed = [layout.fixed(1), layout.fixed(1), layout.fixed(2), layout.fixed(2)]
+placed += [layout.fixed(4), layout.fixed(1), layout.auto(5), layout.fixed(1)]
+placed += [layout.fixed(1), layout.fixed(8), layout.fixed(2)]
+if placed != [0, 1, 4, 6, 8, 2, 12, 3, 24, 28, 36] or layout.offset != 40:
+    raise AssertionError("Data layout offsets do not match")
+writer = KBinWriter()
+writer.start("root")
+for name, nodeType, value in (
+    ("a", "u8", 1),
+    ("b", "u8", 2),
+    ("c", "u16", 3),
+    ("d", "u16", 4),
+    ("e", "u32", 5),
+    ("f", "u8", 6),
+    ("g", "str", "abcd"),
+    ("h", "u8", 7),
+    ("i", "u8", 8),
+    ("j", "u64", 9),
+    ("k", "u16", 10),
+):
+    writer.value(name, nodeType, value)
+writer.end()
+packed = bytes.fromhex(
+    "01020607 00030004 00000005 00000005 61626364 00000000"
+    "08000000 00000000 00000009 000a0000"
+)
+if writer.finish()[-44:] != struct.pack(">I", 40) + packed:
+    raise AssertionError("Data layout packing does not match")
+else:
+    print("Data layout correct!")
+
+edited = KBinXML(expected_bin)
+edited.xml_doc.find("aligned").text = "99"
+edited.xml_doc.find("xXx_T4GG3R_xXx").text = "10 11"
+edited.xml_doc.find("superstar").text = "A much longer string than before"
+edited.xml_doc.find("superstar").attrib["babe"] = "x"
+edited.xml_doc.find("aligned_arr").text = "1 2 3 4 5"
+edited.xml_doc.find("aligned_arr").attrib["__count"] = "5"
+patcher = KBinPatcher(expected_bin)
+patcher.set("test/aligned", 99)
+patcher.set("test/superstar", "A much longer string than before")
+patcher.set_attr("test/superstar", "babe", "x")
+patcher.set("test/aligned_arr", [1, 2, 3, 4, 5])
+patcher.set("test/xXx_T4GG3R_xXx", (10, 11))
+if patcher.to_binary() != edited.to_binary():
+    raise AssertionError("Patched binary does not match")
+else:
+    print("Binary patching correct!")
+
+cache = EncodeCache(maxsize=2)
+changed = KBinXML(xml_in)
+changed.xml_doc.find("aligned").text = "13"
+if fingerprint(KBinXML(expected_bin)) != fingerprint(KBinXML(expected_bin)):
+    raise AssertionError("Fingerprints of equal documents do not match")
+if fingerprint(changed) == fingerprint(KBinXML(xml_in)):
+    raise AssertionError("Fingerprints of different documents match")
+if cache.encode(KBinXML(xml_in)) != expected_bin:
+    raise AssertionError("Encode cache output does not match")
+if cache.encode(KBinXML(xml_in)) != expected_bin:
+    raise AssertionError("Encode cache repeated output does not match")
+if cache.to_text(KBinXML(expected_bin)) != expected_xml:
+    raise AssertionError("Encode cache text does not match")
+if cache.encode(changed) != changed.to_binary() or cache.evictions != 1:
+    raise AssertionError("Encode cache eviction does not match")
+if (cache.hits, cache.misses) != (1, 3):
+    raise AssertionError("Encode cache stats do not match")
+else:
+    print("Encode cache correct!")
+
+# these all encode the same, but their text doesn't match
+text_cache = EncodeCache()
+for text in (
+    b'<a p="1" q="2"><!-- secret --><b __type="u8">1</b></a>',
+    b'<a p="1" q="2"><b __type="u8">1</b></a>',
+    b'<a q="2" p="1"><b __type="u8">1</b></a>',
+    b'<a q="2" p="1" xmlns:x="urn:x"><b __type="u8">1</b></a>',
+):
+    if text_cache.to_text(KBinXML(text)) != KBinXML(text).to_text():
+        raise AssertionError(f"Encode cache text for {text} does not match")
+if text_cache.to_text(KBinXML(text)) != KBinXML(text).to_text() or text_cache.hits != 1:
+    raise AssertionError("Encode cache repeated text does not match")
+else:
+    print("Encode cache text correct!")
+
+# names and values can hold anything, they mustn't run into each other
+joined = KBinNode("root", attrs={"a": "x\x02b\x02c"})
+split = KBinNode("root", attrs={"a": "x", "b": "c"})
+if fingerprint(joined) == fingerprint(split):
+    raise AssertionError("Fingerprints of different attributes match")
+equal_values = [(1, 2)]
+if numpy is not None:
+    equal_values += [numpy.array([1, 2]), numpy.array([1, 2], "int8")]
+equal_nodes = [KBinNode("root", "s32", v, is_array=True) for v in equal_values]
+if len({fingerprint(node) for node in equal_nodes}) != 1:
+    raise AssertionError("Fingerprints of equal NumPy values do not match")
+else:
+    print("Fingerprint fields correct!")
+
+header = validate(expected_bin)
+if header != inspect_header(BytesIO(expected_bin)) or header.size != len(expected_bin):
+    raise AssertionError("Validated header does not match")
+for bad, limits in (
+    (expected_bin[:-1], {}),
+    (expected_bin[:100], {}),
+    (expected_bin, {"max_nodes": 74}),
+    (expected_bin, {"max_depth": 1}),
+    (expected_bin, {"max_string_length": 4}),
+    (expected_bin, {"max_array_bytes": 4}),
+):
+    try:
+        validate(bad, **limits)
+    except KBinException:
+        pass
+    else:
+        raise AssertionError(f"Validation with {limits} did not fail")
+print("Validation correct!")
+
+
+# every reader shares one header check, an unknown encoding is an error too
+def feed(data):
+    parser = KBinFeedParser()
+    parser.feed(data)
+    return parser.close()
+
+
+unknown_encoding = expected_bin[:2] + b"\x10\xef" + expected_bin[4:]
+for bad, readers in (
+    (unknown_encoding, (KBinXML, KBinDocument, validate, inspect_header)),
+    (b"\xa0\x42\x80", (KBinXML, KBinDocument, validate, inspect_header)),
+    # a complete header, but nothing after it
+    (expected_bin[:8], (KBinXML, KBinDocument, validate)),
+):
+    for read in readers + (feed,):
+        try:
+            read(bad)
+        except KBinException:
+            pass
+        else:
+            raise AssertionError(f"{read} accepted a bad header")
+print("Header checks correct!")
+
+# binary only work must not need lxml, or import NumPy
+without_lxml = """
+import sys
+sys.modules["lxml"] = None
+from kbinxml import *
+assert "numpy" not in sys.modules
+data = open("testcases_out.kbin", "rb").read()
+validate(data)
+node = KBinNode.from_binary(data)
+assert node.to_binary() == data
+assert KBinDocument(data).root.to_node().to_binary() == data
+assert KBinPatcher(bytearray(data)).to_binary() == data
+assert transcode(transcode(data, "UTF-8"), "cp932") == data
+assert KBinTemplate(node).render() == data
+codec = KBinCodec()
+assert codec.encode(codec.decode_node(data)) == data
+assert EncodeCache().encode(node) == data
+assert list(iterparse(data))[0][0] == "start"
+assert "numpy" not in sys.modules
+"""
+if subprocess.run([sys.executable, "-c", without_lxml]).returncode:
+    raise AssertionError("Binary only use needs lxml")
+else:
+    print("Lazy lxml import correct!")
+
+# binary to binary, without going through XML
+converted = [
+    (transcode(expected_bin, compressed=False), k.to_binary(compressed=False)),
+    (transcode(expected_bin, "UTF-8"), k.to_binary("UTF-8")),
+    (
+        transcode(transcode(expected_bin, "EUC_JP", False), "cp932", True),
+        expected_bin,
+    ),
+    (transcode(expected_bin), expected_bin),
+]
+if any(got != want for got, want in converted):
+    raise AssertionError("Transcoded binary differs from re-encoding")
+else:
+    print("Transcoder correct!")
@@ -0,0 +1,124 @@
+"""Binary to binary conversion between encodings and name compression.
+
+Converting through `KBinXML` decodes every value to text and parses it
+back. Here the node section is copied with only the names re-packed, and
+the data section is copied in blocks, with only strings and attribute
+values re-encoded (and only when the encoding changes). Every value after
+a re-encoded string moves by whole dwords, so 1 and 2 byte values packed
+together stay packed the same way.
+"""
+
+from .format_ids import xml_formats
+from .kbinxml import (
+    ATTR,
+    END_SECTION,
+    NODE_END,
+    NODE_START,
+    STRING,
+    KBinReader,
+    KBinWriter,
+    _u32,
+    decode_string,
+)
+from .layout import DataLayout
+from . import stringcache
+
+
+def transcode(
+    input, encoding=None, compressed=None, convert_illegal_things=False
+) -> bytes:
+    """Convert a binary to another `encoding` and/or name compression (None
+    keeps the input's). The result is the same as
+    `KBinXML(input).to_binary(encoding, compressed)`, except that values
+    keep their exact bits: floats aren't rounded to 6 decimal places, and
+    names aren't changed by `convert_illegal_things`"""
+    reader = KBinReader(input, convert_illegal_things)
+    try:
+        return _transcode(reader, encoding, compressed)
+    finally:
+        reader.close()
+
+
+def _skip_name(data, offset, compressed) -> int:
+    if compressed:
+        return offset + 1 + (data[offset] * 6 + 7) // 8
+    return offset + 1 + (data[offset] & ~64) + 1
+
+
+def _transcode(reader: KBinReader, encoding, compressed) -> bytes:
+    sourceEncoding = reader.encoding
+    if encoding is None:
+        encoding = sourceEncoding
+    if compressed is None:
+        compressed = reader.compressed
+    writer = KBinWriter(encoding, compressed)
+    reencode = encoding != sourceEncoding
+    # sixbit names don't depend on the encoding
+    rename = compressed != reader.compressed or (not compressed and reencode)
+
+    source = reader.nodeBuf.data
+    nodeBuf = reader.nodeBuf
+    nodeOut = writer.nodeBuf
+    dataStart = nodeBuf.end + 4
+    dataEnd = dataStart + reader.dataSize
+    layout = DataLayout(dataStart)
+    blocks = []
+    # everything in the data section before this has been handled
+    copied = dataStart
+
+    # when neither the names nor the strings change, both sections are copied
+    while (rename or reencode) and nodeBuf.hasData():
+        nodeType = nodeBuf.get_u8()
+        if nodeType == 0:
+            continue
+        rawType = nodeType
+        nodeType &= ~64
+        if nodeType == END_SECTION:
+            break
+        if rename:
+            nodeOut.append_u8(rawType)
+        if nodeType == NODE_END:
+            continue
+        if rename:
+            writer.append_node_name(reader.read_node_name())
+        else:
+            nodeBuf.offset = _skip_name(source, nodeBuf.offset, reader.compressed)
+        if nodeType == NODE_START or not reencode:
+            continue
+        if nodeType not in xml_formats:
+            raise NotImplementedError("Implement node {}".format(nodeType))
+
+        fmt = xml_formats[nodeType]
+        if not rawType & 64 and fmt.get("count", -1) != -1:
+            layout.fixed(fmt["struct"].size)
+            continue
+        offset = layout.offset
+        length = _u32.unpack_from(source, offset)[0]
+        layout.auto(length)
+        if nodeType != STRING and nodeType != ATTR:
+            continue
+
+        raw = bytes(source[offset + 4 : offset + 4 + length - 1])
+        if nodeType == ATTR:
+            # as KBinReader.data_grab_string and KBinWriter.data_append_string
+            string = decode_string(raw, sourceEncoding, reader.convert_illegal_things)
+            payload = stringcache.encode(string, encoding) + b"\0"
+        else:
+            # as KBinReader.data_grab_node_string and KBinWriter.start
+            string = stringcache.decode(raw, sourceEncoding).strip("\0")
+            payload = stringcache.encode(string, encoding, "replace") + b"\0"
+        blocks.append(source[copied:offset])
+        blocks.append(_u32.pack(len(payload)) + payload + bytes(-len(payload) % 4))
+        copied = layout.offset
+
+    if not rename:
+        # the node section as it was, up to its end marker
+        end = nodeBuf.end
+        while end > 8 and source[end - 1] != END_SECTION | 64:
+            end -= 1
+        nodeOut.append_bytes(source[8 : end - 1])
+    blocks.append(source[copied:dataEnd])
+    dataBuf = writer.dataBuf
+    for block in blocks:
+        dataBuf.append_bytes(block)
+    return writer.finish()
@@ -0,0 +1,158 @@
+"""Checks for untrusted binaries, without decoding them.
+
+`validate` walks the node section once, checking every length and offset
+against the buffer, so a corrupt or hostile document is rejected before
+anything is allocated for it. `inspect_header` only reads the header.
+"""
+
+import os
+
+from .format_ids import xml_formats
+from .kbinxml import (
+    ATTR,
+    END_SECTION,
+    NODE_END,
+    NODE_START,
+    KBinException,
+    KBinHeader,
+    _u32,
+    parse_header,
+)
+from .layout import DataLayout
+
+MAX_DEPTH = 256
+MAX_NODES = 1_000_000
+MAX_STRING_LENGTH = 1024 * 1024
+MAX_ARRAY_BYTES = 16 * 1024 * 1024
+
+
+def inspect_header(source) -> KBinHeader:
+    """Encoding, compression and section sizes of a document, given as a
+    buffer, a path or a binary file. Only the first 8 bytes and the data
+    size after the node section are read. From a file that can't seek,
+    only the first 8 bytes are, and `data_size` is None. Files are left
+    where they were"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return inspect_header(f)
+    if not hasattr(source, "read"):
+        header = parse_header(source[:8])
+        dataStart = 8 + header.node_size
+        if len(source) < dataStart + 4:
+            return header
+        return header._replace(data_size=_u32.unpack_from(source, dataStart)[0])
+
+    seekable = hasattr(source, "seekable") and source.seekable()
+    start = source.tell() if seekable else None
+    header = parse_header(source.read(8))
+    if not seekable:
+        return header
+    try:
+        source.seek(start + 8 + header.node_size)
+        dataSize = source.read(4)
+    finally:
+        source.seek(start)
+    if len(dataSize) < 4:
+        return header
+    return header._replace(data_size=_u32.unpack(dataSize)[0])
+
+
+def validate(
+    data,
+    max_depth=MAX_DEPTH,
+    max_nodes=MAX_NODES,
+    max_string_length=MAX_STRING_LENGTH,
+    max_array_bytes=MAX_ARRAY_BYTES,
+) -> KBinHeader:
+    """Check that `data` is a well formed document within the limits, raising
+    `KBinException` if not. Strings (attributes included) are limited by
+    `max_string_length` bytes, arrays and binary by `max_array_bytes`.
+
+    Values aren't decoded, so an undecodable string only fails when read,
+    but nothing is ever read outside the sections it belongs to"""
+    header = parse_header(data)
+    nodeEnd = 8 + header.node_size
+    if nodeEnd + 4 > len(data):
+        raise KBinException("Node section runs past the end of the input")
+    dataSize = _u32.unpack_from(data, nodeEnd)[0]
+    dataStart = nodeEnd + 4
+    dataEnd = dataStart + dataSize
+    if dataEnd > len(data):
+        raise KBinException("Data section runs past the end of the input")
+
+    def check_value(offset, size, what):
+        if offset + size > dataEnd:
+            raise KBinException(f"{what} runs past the end of the data section")
+
+    def auto_value(limit, what, itemSize=1):
+        check_value(layout.offset, 4, what)
+        length = _u32.unpack_from(data, layout.offset)[0]
+        if length > limit:
+            raise KBinException(f"{what} is {length} bytes, the limit is {limit}")
+        if length % itemSize:
+            # the reader would skip a different amount, and lose its place
+            raise KBinException(f"{what} is not a whole number of values")
+        check_value(layout.auto(length) + 4, length, what)
+
+    layout = DataLayout(dataStart)
+    compressed = header.compressed
+    nodeOff = 8
+    depth = 0
+    nodes = 0
+    while nodeOff < nodeEnd:
+        nodeType = data[nodeOff]
+        nodeOff += 1
+        if nodeType == 0:
+            continue
+        isArray = bool(nodeType & 64)
+        nodeType &= ~64
+
+        if nodeType == NODE_END:
+            depth = max(depth - 1, 0)
+            continue
+        elif nodeType == END_SECTION:
+            break
+        elif nodeType not in xml_formats:
+            raise KBinException(f"Unknown node type {nodeType} at offset {nodeOff - 1}")
+
+        if nodeOff >= nodeEnd:
+            raise KBinException("Node name runs past the end of the node section")
+        if compressed:
+            nodeOff += 1 + (data[nodeOff] * 6 + 7) // 8
+        else:
+            nodeOff += 1 + (data[nodeOff] & ~64) + 1
+        if nodeOff > nodeEnd:
+            raise KBinException("Node name runs past the end of the node section")
+
+        if nodeType == ATTR:
+            if not depth:
+                raise KBinException(f"Attribute at offset {nodeOff} has no parent node")
+            auto_value(max_string_length, "Attribute value")
+            continue
+
+        nodes += 1
+        if nodes > max_nodes:
+            raise KBinException(f"Document has more than {max_nodes} nodes")
+        depth += 1
+        if depth > max_depth:
+            raise KBinException(f"Document is nested deeper than {max_depth} nodes")
+        if nodeType == NODE_START:
+            continue
+
+        nodeFormat = xml_formats[nodeType]
+        name = nodeFormat["name"]
+        if nodeFormat["count"] == -1:
+            if name == "str":
+                auto_value(max_string_length, "String")
+            else:
+                auto_value(max_array_bytes, "Binary value")
+        elif isArray:
+            itemSize = nodeFormat["size"] * nodeFormat["count"]
+            auto_value(max_array_bytes, f"{name} array", itemSize)
+        else:
+            size = nodeFormat["struct"].size
+            check_value(layout.fixed(size), size, f"{name} value")
+
+    if not nodes:
+        raise KBinException("kbin document has no nodes")
+    return header._replace(data_size=dataSize)
@@ -0,0 +1,33 @@
+"""lxml, imported the first time something XML facing needs it.
+
+Working only with binaries and `KBinNode`s never imports it, which keeps
+start up quick and lets that run without lxml installed: decoding,
+encoding, validating, patching and transcoding binaries, `KBinDocument`,
+templates, `KBinCodec.encode` of nodes and `decode_node`, and fingerprints
+of nodes. Anything with XML text or `KBinXML` on either side does need it,
+including the text emitter and encoder, `KBinCodec.decode` and the feed
+parser.
+"""
+
+import sys
+
+
+def get_etree():
+    """The `lxml.etree` module"""
+    etree = sys.modules.get("lxml.etree")
+    if etree is None:
+        import lxml.etree as etree
+    return etree
+
+
+def is_element(obj) -> bool:
+    """Whether `obj` is an lxml element. If lxml was never imported, nothing
+    can be one, so this doesn't import it"""
+    etree = sys.modules.get("lxml.etree")
+    return etree is not None and isinstance(obj, etree._Element)
+
+
+def is_element_tree(obj) -> bool:
+    """Whether `obj` is an lxml element tree, see `is_element`"""
+    etree = sys.modules.get("lxml.etree")
+    return etree is not None and isinstance(obj, etree._ElementTree)